@@ -0,0 +1,59 @@
+# coding: utf-8
+
+# The audio format that Whisper expects, and loading & saving it as 16-bit WAV files. Doesn't need pyaudio, so it can
+# be used by the benchmarks and the recognition server on machines without a mic.
+
+import wave
+import threading
+import numpy as np
+
+from resample import resample
+
+WHISPER_RATE = 16000        # Whisper models expect 16kHz mono audio
+CHUNK = 1024                # The number of samples in each chunk of audio from the mic
+
+
+def int16_to_float32(samples):
+    # Convert 16-bit PCM into the float32 range [-1, 1) that Whisper expects.
+    return samples.astype(np.float32) / 32768.0
+
+
+def float32_to_int16(audio):
+    # Convert float32 audio in the range [-1, 1) back to 16-bit PCM, such as for saving to a wav file.
+    return (np.clip(audio, -1.0, 32767.0 / 32768.0) * 32768.0).astype(np.int16)
+
+
+def read_wav_file(fname):
+    # Read a 16-bit WAV file as float32 mono audio at its own sampling rate. Returns (audio, rate).
+    wavefile = wave.open(fname, 'rb')
+    rate = wavefile.getframerate()
+    channels = wavefile.getnchannels()
+    samples = np.frombuffer(wavefile.readframes(wavefile.getnframes()), dtype=np.int16)
+    wavefile.close()
+    audio = int16_to_float32(samples)
+    if channels > 1:
+        audio = audio.reshape(-1, channels).mean(axis=1)
+    return audio, rate
+
+
+def load_wav_file(fname):
+    # Load a 16-bit WAV file as float32 mono 16kHz audio.
+    audio, rate = read_wav_file(fname)
+    return resample(audio, rate, WHISPER_RATE)
+
+
+def save_wav_file(fname, samples, rate, channels=1):
+    # Write int16 samples to a wav file. 'fname' can be a filename or a file object.
+    wavefile = wave.open(fname, 'wb')
+    wavefile.setnchannels(channels)
+    wavefile.setsampwidth(2)    # 16-bit audio
+    wavefile.setframerate(rate)
+    wavefile.writeframes(samples.tobytes())
+    wavefile.close()
+
+
+def save_wav_file_async(fname, samples, rate, channels=1):
+    # Write the wav file on a background thread, so debug recordings don't delay speech recognition.
+    thread = threading.Thread(target=save_wav_file, args=(fname, samples.copy(), rate, channels), daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Headless end-to-end benchmark of the whole dictation pipeline, without a mic, keyboard or display.
+# WAV clips are "dictated" by a scripted hotkey timeline through the same startDictation() / stopDictation() code as
+# real dictation (including the VAD, recognition queue, batching, post-processing and keyboard output thread), and
+# the typed text is captured instead of pressing keys. The timeline can run faster than real-time, to load test it.
+# Reports the throughput and the latency from releasing the hotkey until the text was typed, and can be used as a
+# regression gate: it returns an error code if the p95 latency or throughput is worse than the given limits or than a
+# previously saved baseline report.
+#
+# Examples:
+#   ./benchmark_e2e.py recordings/ --model tiny.en --speed 4 --json baseline.json
+#   ./benchmark_e2e.py recordings/ --model tiny.en --speed 4 --baseline baseline.json --tolerance 0.2
+#   ./benchmark_e2e.py --timeline session.jsonl --max-p95 1.5
+
+import os
+import sys
+import json
+import time
+import argparse
+
+from audio_io import WHISPER_RATE, load_wav_file
+from replay import ReplayAudioSource, ScriptedHotkeySource, CapturingTyper, load_timeline, timeline_from_clips
+from benchmark_models import configureWhisper, percentile, wordErrors
+
+
+def loadClips(folder):
+    files = sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith(".wav"))
+    return [(fname, load_wav_file(fname)) for fname in files]
+
+
+def loadReferenceText(timeline):
+    # The reference transcripts ("name.txt" next to each "name.wav"), only if every clip has one.
+    texts = []
+    for event in timeline:
+        if event["event"] != "down":
+            continue
+        ref_fname = os.path.splitext(event["clip"])[0] + ".txt"
+        if not os.path.exists(ref_fname):
+            return None
+        with open(ref_fname, 'r', encoding="utf-8") as f:
+            texts.append(f.read())
+    return " ".join(texts)
+
+
+def runTimeline(args, timeline):
+    from keyboard_output import KeyboardOutput
+    from latency_trace import LatencyTracer
+
+    ptt_whisper = configureWhisper(args.model, args.backend, args.compute_type, args.beam, args.workers, args.device)
+    ptt_whisper.NUM_RECOGNITION_WORKERS = args.workers if ptt_whisper.USE_FASTER_WHISPER else 1
+    ptt_whisper.ENABLE_TYPING = True
+    if not ptt_whisper.latency_tracer:
+        ptt_whisper.latency_tracer = LatencyTracer()
+
+    audio_source = ReplayAudioSource(args.speed)
+    typer = CapturingTyper(args.char_delay)
+    ptt_whisper.startPipeline(audio_source, KeyboardOutput(typer))
+    ptt_whisper.model_ready.wait()
+    if ptt_whisper.model_error:
+        print("ERROR: Couldn't load the Whisper model:", ptt_whisper.model_error)
+        return None
+    if ptt_whisper.ENABLE_DRAFT_MODEL:
+        ptt_whisper.draft_model_ready.wait(60)
+
+    print("Running the timeline of", len(timeline), "hotkey events at", args.speed, "x speed ...")
+    hotkeys = ScriptedHotkeySource(timeline, audio_source, args.speed)
+    start = time.perf_counter()
+    hotkeys.run(ptt_whisper.dictationKeyPressed, ptt_whisper.dictationKeyReleased, ptt_whisper.cancelDictation)
+    # Wait for the last recordings to be recognised & typed.
+    while ptt_whisper.recognition_queue.pending() > 0:
+        time.sleep(0.01)
+    ptt_whisper.keyboard_output.wait_until_idle()
+    wall_seconds = time.perf_counter() - start
+    ptt_whisper.recognition_queue.shutdown()
+
+    traces = ptt_whisper.latency_tracer.traces()
+    latencies = [t.span("key_up", "typing_done") for t in traces if t.outcome in ("typed", "empty")]
+    latencies = [v for v in latencies if v is not None]
+    outcomes = {}
+    for t in traces:
+        outcomes[t.outcome] = outcomes.get(t.outcome, 0) + 1
+    audio_seconds = sum(len(e["audio"]) for e in timeline if e["event"] == "down") / float(WHISPER_RATE)
+    report = {"model": args.model, "backend": args.backend, "compute_type": args.compute_type, "beam_size": args.beam,
+              "workers": args.workers, "speed": args.speed,
+              "utterances": len(traces),
+              "outcomes": outcomes,
+              "audio_seconds": audio_seconds,
+              "wall_seconds": wall_seconds,
+              "throughput": audio_seconds / wall_seconds,
+              "utterances_per_second": len(traces) / wall_seconds,
+              "p50": percentile(latencies, 50),
+              "p95": percentile(latencies, 95),
+              "max": max(latencies) if latencies else 0.0,
+              "typed_chars": len(typer.text),
+              "wer": None}
+
+    reference = loadReferenceText(timeline)
+    if reference is not None:
+        errors, words = wordErrors(reference, typer.text)
+        report["wer"] = 100.0 * errors / words if words else None
+    print(ptt_whisper.latency_tracer.summary())
+    return report
+
+
+def checkRegressions(args, report):
+    # Returns a list of the ways that the report is worse than the limits or the baseline.
+    problems = []
+    if args.max_p95 is not None and report["p95"] > args.max_p95:
+        problems.append('p95 latency {0:.3f} s is above the limit of {1:.3f} s'.format(report["p95"], args.max_p95))
+    if args.min_throughput is not None and report["throughput"] < args.min_throughput:
+        problems.append('throughput {0:.2f}x is below the limit of {1:.2f}x'.format(report["throughput"],
+                                                                                    args.min_throughput))
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if report["p95"] > baseline["p95"] * (1.0 + args.tolerance):
+            problems.append('p95 latency {0:.3f} s is more than {1:.0f}% above the baseline of {2:.3f} s'.format(
+                            report["p95"], 100 * args.tolerance, baseline["p95"]))
+        if report["throughput"] < baseline["throughput"] * (1.0 - args.tolerance):
+            problems.append('throughput {0:.2f}x is more than {1:.0f}% below the baseline of {2:.2f}x'.format(
+                            report["throughput"], 100 * args.tolerance, baseline["throughput"]))
+    return problems
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Headless end-to-end latency & throughput test of the dictation pipeline.")
+    parser.add_argument("folder", nargs="?", help="Folder of .wav files to dictate one after another")
+    parser.add_argument("--timeline", help="JSON lines file of hotkey events, instead of a folder")
+    parser.add_argument("--gap", type=float, default=0.5, help="Seconds between the clips of a folder")
+    parser.add_argument("--speed", type=float, default=1.0, help="Run the timeline this many times faster than real-time")
+    parser.add_argument("--model", default="tiny.en")
+    parser.add_argument("--backend", default="faster-whisper", help="faster-whisper or whisper")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--compute-type", default="int8")
+    parser.add_argument("--beam", type=int, default=1, help="Value to use for both BEAM_SIZE and BEST_OF")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--char-delay", type=float, default=0.0, help="Simulated typing time per character")
+    parser.add_argument("--json", help="Save the report to this JSON file, such as to use as a baseline")
+    parser.add_argument("--baseline", help="Fail if the results are worse than this previously saved report")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed fraction worse than the baseline")
+    parser.add_argument("--max-p95", type=float, help="Fail if the p95 latency is above this many seconds")
+    parser.add_argument("--min-throughput", type=float, help="Fail if fewer seconds of audio are handled per second")
+    args = parser.parse_args(argv)
+
+    if args.timeline:
+        timeline = load_timeline(args.timeline)
+    elif args.folder:
+        clips = loadClips(args.folder)
+        if not clips:
+            print("ERROR: No .wav files found in '" + args.folder + "'")
+            return 1
+        timeline = timeline_from_clips(clips, args.gap)
+    else:
+        parser.error("Give a folder of WAV files or a --timeline")
+
+    report = runTimeline(args, timeline)
+    if report is None:
+        return 1
+
+    print()
+    print('{0} utterances ({1:.1f} seconds of audio) in {2:.2f} seconds: throughput {3:.2f}x real-time, '
+          '{4:.2f} utterances per second'.format(report["utterances"], report["audio_seconds"], report["wall_seconds"],
+                                                  report["throughput"], report["utterances_per_second"]))
+    print('Key up to typed: p50 {0:.3f} s, p95 {1:.3f} s, max {2:.3f} s. Outcomes: {3}'.format(
+          report["p50"], report["p95"], report["max"], report["outcomes"]))
+    if report["wer"] is not None:
+        print('WER: {0:.1f}%'.format(report["wer"]))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    problems = checkRegressions(args, report)
+    for problem in problems:
+        print("REGRESSION:", problem)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Offline benchmark of speech recognition speed & accuracy, running a folder of WAV files through the same decoding
+# path as the dictation (performSpeechRecOnFile) for every combination of model, compute type, beam size, number of
+# workers and backend. Runs on the CPU, so you can find the cheapest settings that meet your latency budget.
+# For each combination it reports the real-time factor, p50/p95 latency, peak RAM usage, and the word error rate
+# (WER) if there is a reference transcript "name.txt" next to each "name.wav".
+#
+# Example:
+#   ./benchmark_models.py recordings/ --models tiny.en,base.en,medium.en --compute-types int8,float32 --beams 1,5
+
+import os
+import re
+import sys
+import time
+import json
+import argparse
+import resource
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from audio_io import WHISPER_RATE, load_wav_file
+
+
+def normaliseText(text):
+    return re.sub(r"[^\w\s']", " ", text.lower()).split()
+
+
+def wordErrors(reference, hypothesis):
+    # Word-level Levenshtein distance, returning (errors, number of reference words).
+    ref = normaliseText(reference)
+    hyp = normaliseText(hypothesis)
+    row = list(range(len(hyp) + 1))
+    for i in range(1, len(ref) + 1):
+        previous, row[0] = row[0], i
+        for j in range(1, len(hyp) + 1):
+            current = min(row[j] + 1, row[j - 1] + 1, previous + (ref[i - 1] != hyp[j - 1]))
+            previous, row[j] = row[j], current
+    return row[len(hyp)], len(ref)
+
+
+def percentile(values, p):
+    return float(np.percentile(values, p)) if values else 0.0
+
+
+def configureWhisper(model, backend, compute_type, beam_size, workers, device="cpu"):
+    # Set up ptt_whisper to decode with the given settings, and return it. The transcription cache is turned off, and
+    # a fresh hallucination guard that isn't saved is used, so the benchmark doesn't change the user's own thresholds.
+    import ptt_whisper
+    from hallucination_guard import HallucinationGuard
+    ptt_whisper.model_filename = model
+    ptt_whisper.COMPUTE_DEVICE = device
+    ptt_whisper.COMPUTE_TYPE = compute_type
+    ptt_whisper.BEAM_SIZE = beam_size
+    ptt_whisper.BEST_OF = beam_size
+    ptt_whisper.NUM_FASTER_WHISPER_WORKERS = workers
+    ptt_whisper.USE_FASTER_WHISPER = (backend == "faster-whisper")
+    ptt_whisper.transcription_cache = None
+    if ptt_whisper.hallucination_guard:
+        ptt_whisper.hallucination_guard = HallucinationGuard(None)
+    return ptt_whisper
+
+
+def runCombination(combo, files):
+    # Runs in a separate process, so that each combination gets a fresh model and its own peak RAM measurement.
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""     # Make sure OpenAI Whisper also runs on the CPU
+    ptt_whisper = configureWhisper(combo["model"], combo["backend"], combo["compute_type"], combo["beam_size"],
+                                   combo["workers"])
+
+    start = time.perf_counter()
+    ptt_whisper.loadWhisperModel()
+    load_seconds = time.perf_counter() - start
+    if ptt_whisper.USE_FASTER_WHISPER != (combo["backend"] == "faster-whisper"):
+        return {"error": "backend " + combo["backend"] + " isn't available"}
+
+    clips = [(fname, load_wav_file(fname)) for fname in files]
+    # Warm up the model, since the first invocation is much slower than the others.
+    ptt_whisper.performSpeechRecOnFile(clips[0][1], use_cache=False)
+
+    def transcribe(clip):
+        fname, audio = clip
+        start = time.perf_counter()
+        text = ptt_whisper.performSpeechRecOnFile(audio, use_cache=False)
+        return fname, text, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=combo["workers"]) as pool:
+        results = list(pool.map(transcribe, clips))
+    wall_seconds = time.perf_counter() - start
+
+    errors = 0
+    ref_words = 0
+    for fname, text, _ in results:
+        ref_fname = os.path.splitext(fname)[0] + ".txt"
+        if os.path.exists(ref_fname):
+            with open(ref_fname, 'r', encoding="utf-8") as f:
+                e, n = wordErrors(f.read(), text)
+            errors += e
+            ref_words += n
+
+    latencies = [r[2] for r in results]
+    audio_seconds = sum(len(audio) for _, audio in clips) / WHISPER_RATE
+    return {"load_seconds": load_seconds,
+            "rtf": wall_seconds / audio_seconds,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+            "wer": 100.0 * errors / ref_words if ref_words else None}
+
+
+def buildMatrix(args):
+    combos = []
+    for backend in args.backends.split(","):
+        for model in args.models.split(","):
+            # OpenAI Whisper on the CPU only uses float32, and isn't thread-safe, so don't repeat those combinations.
+            compute_types = args.compute_types.split(",") if backend == "faster-whisper" else ["float32"]
+            workers_list = [int(w) for w in args.workers.split(",")] if backend == "faster-whisper" else [1]
+            for compute_type in compute_types:
+                for beam_size in [int(b) for b in args.beams.split(",")]:
+                    for workers in workers_list:
+                        combos.append({"backend": backend, "model": model, "compute_type": compute_type,
+                                       "beam_size": beam_size, "workers": workers})
+    return combos
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark Whisper settings on a folder of WAV files, on the CPU.")
+    parser.add_argument("folder", help="Folder of .wav files, with optional .txt reference transcripts")
+    parser.add_argument("--models", default="tiny.en,base.en,small.en,medium.en")
+    parser.add_argument("--compute-types", default="int8,float32", help="Only used by faster-whisper")
+    parser.add_argument("--beams", default="1,5", help="Values to use for both BEAM_SIZE and BEST_OF")
+    parser.add_argument("--workers", default="1", help="Values for NUM_FASTER_WHISPER_WORKERS")
+    parser.add_argument("--backends", default="faster-whisper", help="faster-whisper and/or whisper")
+    parser.add_argument("--json", help="Also save the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    files = sorted(os.path.join(args.folder, f) for f in os.listdir(args.folder) if f.lower().endswith(".wav"))
+    if not files:
+        print("ERROR: No .wav files found in '" + args.folder + "'")
+        return 1
+
+    combos = buildMatrix(args)
+    print("Benchmarking", len(combos), "combinations on", len(files), "WAV files ...")
+    results = []
+    ctx = multiprocessing.get_context("spawn")
+    for combo in combos:
+        with ctx.Pool(processes=1) as pool:
+            result = pool.apply(runCombination, (combo, files))
+        result.update(combo)
+        results.append(result)
+
+    print()
+    print('{0:<15}{1:<12}{2:<14}{3:>5}{4:>8}{5:>8}{6:>9}{7:>9}{8:>10}{9:>8}'.format(
+          "backend", "model", "compute_type", "beam", "workers", "RTF", "p50 s", "p95 s", "RSS MB", "WER %"))
+    for r in results:
+        if "error" in r:
+            print('{0:<15}{1:<12}'.format(r["backend"], r["model"]), "ERROR:", r["error"])
+            continue
+        wer = '{0:.1f}'.format(r["wer"]) if r["wer"] is not None else "-"
+        print('{0:<15}{1:<12}{2:<14}{3:>5}{4:>8}{5:>8.3f}{6:>9.3f}{7:>9.3f}{8:>10.0f}{9:>8}'.format(
+              r["backend"], r["model"], r["compute_type"], r["beam_size"], r["workers"],
+              r["rtf"], r["p50"], r["p95"], r["peak_rss_mb"], wer))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
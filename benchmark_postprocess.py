@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Benchmark of the text post-processing, to check that the user's replacement rules don't add noticeable latency,
+# even with thousands of entries. Compares the original string-concatenation clean up against TextPostprocessor
+# with growing numbers of word replacements (plus a few regex rules & spoken punctuation), on a long transcript.
+# Usage: ./benchmark_postprocess.py
+
+import sys
+import time
+import random
+
+from postprocess import TextPostprocessor, SPOKEN_PUNCTUATION
+
+RULE_COUNTS = (0, 10, 100, 1000, 5000)
+NUM_SENTENCES = 2000
+REPEATS = 5
+
+WORDS = ("the quick brown fox jumps over lazy dog while I benchmark a profile of ARM CPU core optimisations such as "
+         "on A53 CPUs using pie torch and get hub with new line comma in my forties").split()
+
+
+def originalPostprocessSentence(text):
+    # The clean up that was used before TextPostprocessor, for comparison.
+    sentence = text
+    if sentence.startswith(" "):
+        sentence = sentence[1:]
+    if sentence.endswith(" "):
+        sentence = sentence[:-1]
+    sentence = sentence[0].upper() + sentence[1:]
+    if sentence.endswith("..."):
+        sentence = sentence[:-3]
+    if not sentence.endswith("?") and not sentence.endswith("!") and not sentence.endswith(".") and not sentence.endswith(","):
+        sentence = sentence + "."
+    return sentence + " "
+
+
+def originalJoin(texts):
+    result = ""
+    for text in texts:
+        result = result + originalPostprocessSentence(text)
+    return result
+
+
+def makeTranscript(rng):
+    return [" " + " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 25))) for _ in range(NUM_SENTENCES)]
+
+
+def makeReplacements(rng, count):
+    # Random made-up words & phrases, plus a few that really occur in the transcript.
+    replacements = {"pie torch": "PyTorch", "get hub": "GitHub"}
+    while len(replacements) < count:
+        word = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(4, 10)))
+        if rng.random() < 0.3:
+            word = word + " " + rng.choice(WORDS)
+        replacements[word] = word.upper()
+    return dict(list(replacements.items())[:count])
+
+
+def timePerSentence(function, texts):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        function(texts)
+    return (time.perf_counter() - start) / (REPEATS * len(texts))
+
+
+def main(argv):
+    rng = random.Random(1)
+    texts = makeTranscript(rng)
+    print("Transcript of", len(texts), "sentences,", sum(len(t) for t in texts), "characters.")
+
+    original_us = 1e6 * timePerSentence(originalJoin, texts)
+    print('Original clean up: {0:.2f} us per sentence'.format(original_us))
+
+    regex_rules = [(r"\b[Uu]m+\b,? ?", ""), (r"\bforties\b", "40's")]
+    for count in RULE_COUNTS:
+        start = time.perf_counter()
+        postprocessor = TextPostprocessor(makeReplacements(rng, count), regex_rules, SPOKEN_PUNCTUATION)
+        compile_ms = 1000 * (time.perf_counter() - start)
+        us = 1e6 * timePerSentence(postprocessor.process_segments, texts)
+        print('{0:>5} replacements: {1:.2f} us per sentence ({2:+.2f} us vs original), compiled in {3:.1f} ms'.format(
+              count, us, us - original_us, compile_ms))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
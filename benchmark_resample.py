@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Micro-benchmark comparing the cost of resampling mic audio to 16kHz using our chunked NumPy polyphase resampler,
+# versus the previous path of saving a WAV file and having ffmpeg decode & resample it (as whisper.load_audio does).
+# Usage: ./benchmark_resample.py [optional_44khz_wav_file]
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+import numpy as np
+
+from resample import PolyphaseResampler
+from audio_io import WHISPER_RATE, CHUNK, int16_to_float32, float32_to_int16, read_wav_file, save_wav_file
+
+RATE = 44100        # Sampling rate of the generated audio, a common mic rate
+DURATION = 10.0     # Seconds of audio to resample, when not given a WAV file
+REPEATS = 5
+
+
+def load_or_generate_audio(argv):
+    if len(argv) > 1:
+        return read_wav_file(argv[1])
+    # Generate some speech-like noise: a few tones plus random noise.
+    t = np.arange(int(DURATION * RATE)) / RATE
+    audio = 0.3 * np.sin(2 * np.pi * 220 * t) + 0.2 * np.sin(2 * np.pi * 1800 * t) + 0.05 * np.random.randn(len(t))
+    return audio.astype(np.float32), RATE
+
+
+def benchmark_polyphase(audio, rate):
+    # Process the audio in the same sized chunks that the PortAudio callback gives us.
+    resampler = PolyphaseResampler(rate, WHISPER_RATE)
+    best = None
+    for _ in range(REPEATS):
+        resampler.reset()
+        start = time.perf_counter()
+        for i in range(0, len(audio), CHUNK):
+            resampler.process(audio[i:i + CHUNK])
+        resampler.flush()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmark_ffmpeg(audio, rate):
+    # Write the WAV file and decode it with ffmpeg, the same way whisper.load_audio() does.
+    fname = os.path.join(tempfile.gettempdir(), "benchmark_resample.wav")
+    cmd = ["ffmpeg", "-nostdin", "-threads", "0", "-i", fname, "-f", "s16le", "-ac", "1",
+           "-acodec", "pcm_s16le", "-ar", str(WHISPER_RATE), "-"]
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        save_wav_file(fname, float32_to_int16(audio), rate)
+        out = subprocess.run(cmd, capture_output=True, check=True).stdout
+        int16_to_float32(np.frombuffer(out, np.int16))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    os.remove(fname)
+    return best
+
+
+def main(argv):
+    audio, rate = load_or_generate_audio(argv)
+    seconds = len(audio) / rate
+    print("Resampling", '{0:.1f}'.format(seconds), "seconds of audio from", rate, "Hz to", WHISPER_RATE, "Hz.")
+
+    elapsed = benchmark_polyphase(audio, rate)
+    print("NumPy polyphase (chunked):", '{0:.3f}'.format(1000 * elapsed / seconds), "ms per second of audio")
+
+    if shutil.which("ffmpeg"):
+        elapsed = benchmark_ffmpeg(audio, rate)
+        print("WAV file + ffmpeg:        ", '{0:.3f}'.format(1000 * elapsed / seconds), "ms per second of audio",
+              "(" + '{0:.1f}'.format(1000 * elapsed) + " ms total, mostly fixed process startup cost)")
+    else:
+        print("ffmpeg isn't installed, so skipping the ffmpeg comparison.")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Benchmark of the CPU time spent preparing each utterance for OpenAI Whisper, comparing the original approach of
+# padding every clip to 30 seconds before computing the log-mel spectrogram, against trimming the silence first.
+# Uses synthetic utterances of various lengths, surrounded by 0.5 seconds of background noise.
+# Usage: ./benchmark_silence_trim.py
+
+import sys
+import time
+import numpy as np
+
+from silence import trim_silence, split_on_silence, WHISPER_RATE
+
+SPEECH_SECONDS = (1, 3, 10, 25)
+REPEATS = 10
+
+
+def makeUtterance(speech_seconds):
+    # Noise bursts at speech-like levels, with quiet background noise before & after.
+    rate = WHISPER_RATE
+    audio = (np.random.randn(int(rate * (speech_seconds + 1.0))) * 0.001).astype(np.float32)
+    speech = np.random.randn(int(rate * speech_seconds)) * 0.1 * (1.0 + np.sin(np.arange(int(rate * speech_seconds)) / 800.0))
+    audio[int(rate * 0.5):int(rate * 0.5) + len(speech)] += speech.astype(np.float32)
+    return audio
+
+
+def cpuTime(function, audio):
+    start = time.process_time()
+    for _ in range(REPEATS):
+        function(audio)
+    return (time.process_time() - start) / REPEATS
+
+
+def main(argv):
+    try:
+        import whisper
+    except ImportError:
+        whisper = None
+        print("OpenAI whisper isn't installed, so only measuring the cost of the silence trimming itself.")
+
+    def paddedPath(audio):
+        # The original path: pad to 30 seconds, then compute the spectrogram of all of it.
+        return whisper.log_mel_spectrogram(whisper.pad_or_trim(audio))
+
+    def trimmedPath(audio):
+        # The new path: trim the silence, then only compute the spectrogram of the speech.
+        mels = []
+        for window in split_on_silence(trim_silence(audio)):
+            mels.append(whisper.pad_or_trim(whisper.log_mel_spectrogram(window), whisper.audio.N_FRAMES))
+        return mels
+
+    for seconds in SPEECH_SECONDS:
+        audio = makeUtterance(seconds)
+        trim_ms = 1000 * cpuTime(trim_silence, audio)
+        line = '{0:>3} seconds of speech: trimming takes {1:.3f} ms'.format(seconds, trim_ms)
+        if whisper:
+            padded_ms = 1000 * cpuTime(paddedPath, audio)
+            trimmed_ms = 1000 * cpuTime(trimmedPath, audio)
+            line += ', spectrogram {0:.1f} ms padded vs {1:.1f} ms trimmed (saving {2:.1f} ms CPU per utterance)'.format(
+                    padded_ms, trimmed_ms, padded_ms - trimmed_ms)
+        print(line)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Throughput benchmark (characters per second) of the keyboard output, using a fake keyboard controller so that
+# no real keys get pressed. Compares the original approach of one type() call plus a 2.5ms sleep per character,
+# against the batched PynputTyper.
+# Usage: ./benchmark_typing.py [num_characters] [simulated_seconds_per_key]
+
+import sys
+import time
+
+from keyboard_output import PynputTyper, KeyboardOutput
+
+
+class FakeController(object):
+    '''Pretends to be a pynput keyboard Controller, optionally taking some time per key like a real X server would.'''
+
+    class InvalidCharacterException(Exception):
+        pass
+
+    def __init__(self, seconds_per_key=0.0, invalid_characters=""):
+        self.seconds_per_key = seconds_per_key
+        self.invalid_characters = invalid_characters    # Characters that can't be typed, like pynput's
+        self.typed = []
+
+    def type(self, text):
+        # Like pynput, the characters before an invalid character have already been typed when it raises.
+        for index, character in enumerate(text):
+            if character in self.invalid_characters:
+                raise self.InvalidCharacterException(index, character)
+            if self.seconds_per_key:
+                time.sleep(self.seconds_per_key)
+            self.typed.append(character)
+
+
+def typeEachCharacter(controller, phrase):
+    # The original typeOnKeyboard() loop.
+    for character in phrase:
+        try:
+            controller.type(character)
+            time.sleep(0.0025)
+        except:
+            print("Empty or unknown symbol", character)
+            continue
+
+
+def report(name, num_chars, elapsed):
+    print('{0:<36}'.format(name), '{0:>10.0f}'.format(num_chars / elapsed), "chars/sec",
+          "(" + '{0:.3f}'.format(elapsed) + " seconds)")
+
+
+def main(argv):
+    num_chars = int(argv[1]) if len(argv) > 1 else 500
+    seconds_per_key = float(argv[2]) if len(argv) > 2 else 0.0
+    text = ("The quick brown fox jumps over the lazy dog. " * (num_chars // 45 + 1))[:num_chars]
+    print("Typing", num_chars, "characters, with a simulated", seconds_per_key, "seconds per key.")
+
+    controller = FakeController(seconds_per_key)
+    start = time.perf_counter()
+    typeEachCharacter(controller, text)
+    report("Per-character type() + sleep:", num_chars, time.perf_counter() - start)
+
+    for batch_size in (1, 8, 32, 128):
+        typer = PynputTyper(FakeController(seconds_per_key), batch_size=batch_size)
+        start = time.perf_counter()
+        typer.type(text)
+        report("Batched, " + str(batch_size) + " chars per batch:", num_chars, time.perf_counter() - start)
+
+    # Check that characters which can't be typed are skipped, without typing anything twice.
+    controller = FakeController(invalid_characters="\u2603")
+    PynputTyper(controller, batch_size=8, batch_delay=0).type("abc\u2603def \u2603" + text)
+    expected = "abcdef " + text
+    if "".join(controller.typed) != expected:
+        print("ERROR: Typed", repr("".join(controller.typed)[:40]), "instead of", repr(expected[:40]))
+        return 1
+
+    # Measure how long the caller is blocked when typing on the background thread.
+    output = KeyboardOutput(PynputTyper(FakeController(seconds_per_key)))
+    start = time.perf_counter()
+    output.type_text(text)
+    blocked = time.perf_counter() - start
+    output.wait_until_idle()
+    report("Background thread (total):", num_chars, time.perf_counter() - start)
+    print("Caller was only blocked for", '{0:.6f}'.format(blocked), "seconds.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -1,54 +1,255 @@
 # coding: utf-8
 
 # Provides a way to change the LED color of a BlinkStick USB device
+# The USB I/O happens on a background thread, so that a slow or unplugged BlinkStick never delays the hotkeys.
+# updateLED() just leaves the latest mode in a "mailbox" and returns immediately. If the mode changes several times
+# while the LED thread is busy, only the latest mode is shown. If a working BlinkStick is unplugged, the LED thread keeps
+# trying to reconnect, waiting a bit longer after each failed attempt. If there wasn't a BlinkStick at startup (or the
+# blinkstick module isn't installed), it doesn't keep scanning the USB devices for one.
 # By Shervin Emami (shervin.emami@gmail.com), Jan 2024
 
+import time
+import atexit
+import threading
+
 
 LED_BRIGHTNESS = 5      # LED Brightness can be upto 255. I like faint values around 5
+USE_MOCK_BLINKSTICK = False     # Set to True to test the LED modes without a BlinkStick, printing the colors instead
+
+RECONNECT_MIN_DELAY = 0.5       # Seconds to wait before the first reconnection attempt
+RECONNECT_MAX_DELAY = 30.0      # The delay doubles after each failed attempt, upto this many seconds
+
+
+# The (red, green, blue) color to show for each mode.
+# Examples for grammarMode can be "Normal", "Command", "off", "disabled", "sleeping"
+def modeToColor(grammarMode):
+    V = LED_BRIGHTNESS  # LED Brightness upto 255
+    # Set my BlinkStick LED to green (ON, Normal mode) or blue (ON, Command mode)
+    if grammarMode == "Normal":
+        return (0, V, 0)
+    elif grammarMode == "Yellow":
+        return (V, V, 0)
+    elif grammarMode == "Orange":
+        return (V, V/3, 0)
+    elif grammarMode == "Pink":
+        return (V*1.2, V/3, V/2.5)
+    elif grammarMode == "Loading":
+        # Set my BlinkStick LED to purple (loading the speech recognition model)
+        return (V, 0, V)
+    elif grammarMode == "BlueGreen":
+        return (1, 9, 3)
+    elif grammarMode == "disabled":
+        # Set my BlinkStick LED to red (disabled)
+        return (V*2, 0, 0)
+    elif grammarMode == "sleeping":
+        # Set my BlinkStick LED to purple (sleeping)
+        return (1, 0, 0)
+    elif grammarMode == "off":
+        # Set my BlinkStick LED to black (off)
+        return (0, 0, 0)
+    else:
+        return (0, 0, V*1.2)
+
+
+class MockBlinkStick(object):
+    '''Stands in for a BlinkStick device, for testing without the hardware.
+    It keeps every color it was set to, and can simulate slow USB I/O or an unplugged device.
+    '''
+
+    def __init__(self, delay=0.0, verbose=False):
+        self.delay = delay          # Seconds that each set_color() call takes
+        self.verbose = verbose
+        self.unplugged = False      # Set to True to make set_color() fail, like an unplugged device
+        self.colors = []
+
+    def get_serial(self):
+        return "MOCK0000"
+
+    def set_color(self, red=0, green=0, blue=0):
+        if self.delay:
+            time.sleep(self.delay)
+        if self.unplugged:
+            raise IOError("Mock BlinkStick is unplugged")
+        self.colors.append((red, green, blue))
+        if self.verbose:
+            print("Mock BlinkStick LED color:", (red, green, blue))
 
 
 try:
     from blinkstick import blinkstick
-    bstick = blinkstick.find_first()
-except:
-    bstick = None
+except ImportError:
+    blinkstick = None
+
+def findBlinkStick():
+    # Returns the first BlinkStick device, or None.
+    if blinkstick is None:
+        return None
+    return blinkstick.find_first()
+
+
+class LEDDriver(object):
+    '''Shows the latest requested mode on the LED, from a background thread.
+    'open_device' is a function that returns the device (or None if there isn't one), and is called again to
+    reconnect after a device that was working fails.
+    '''
+
+    def __init__(self, open_device, min_delay=RECONNECT_MIN_DELAY, max_delay=RECONNECT_MAX_DELAY):
+        self._open_device = open_device
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.device = None
+        self._cond = threading.Condition()
+        self._mode = None           # The latest requested mode, waiting to be shown
+        self._shown = None          # The mode currently on the LED
+        self._busy = False          # True while the LED thread is showing a mode
+        self._stopping = False
+        self.coalesced = 0          # Number of modes that were replaced before they could be shown
+        self.failures = 0
+        self._ever_connected = False    # Only try to reconnect to a device that was found before
+        self._retry_delay = min_delay
+        self._next_attempt = 0.0
+        self._connect()
+        self._thread = threading.Thread(target=self._loop, name="BlinkStickLED", daemon=True)
+        self._thread.start()
 
-if bstick:
-    print("Found BlinkStick USB LED", bstick.get_serial())
+    def set_mode(self, mode):
+        # Returns immediately. Only the latest mode is kept if the LED thread hasn't shown the previous one yet.
+        with self._cond:
+            if self._mode is not None:
+                self.coalesced += 1
+            self._mode = mode
+            self._cond.notify()
+
+    def flush(self, timeout=1.0):
+        # Wait (upto timeout seconds) for the latest mode to be shown, such as before exiting.
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while (self._mode is not None or self._busy) and self.device is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+
+    def _connect(self):
+        # Try to open the device, then back off exponentially if that failed.
+        try:
+            self.device = self._open_device()
+        except Exception as e:
+            print("Warning: Couldn't open the BlinkStick USB LED:", e)
+            self.device = None
+        if self.device:
+            self._ever_connected = True
+            self._retry_delay = self.min_delay
+            self._shown = None      # A reconnected device might be showing anything
+        else:
+            self._next_attempt = time.monotonic() + self._retry_delay
+            self._retry_delay = min(self._retry_delay * 2, self.max_delay)
+        return self.device
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    if self._mode is not None:
+                        if self.device is not None:
+                            break
+                        if not self._ever_connected:
+                            # There's no BlinkStick, so just keep the latest mode without scanning the USB devices.
+                            self._cond.wait()
+                            continue
+                        # Wait until it's time to try reconnecting, unless stopped.
+                        delay = self._next_attempt - time.monotonic()
+                        if delay <= 0:
+                            break
+                        self._cond.wait(delay)
+                    else:
+                        self._cond.wait()
+                if self._stopping:
+                    return
+                device = self.device
+                mode = self._mode
+                self._mode = None
+                self._busy = True
+
+            # Do the USB I/O without holding the lock, so set_mode() never waits for it.
+            if device is None:
+                device = self._connect()
+                if device is None:
+                    with self._cond:
+                        if self._mode is None:
+                            self._mode = mode
+                        self._busy = False
+                    continue
+                print("Reconnected to the BlinkStick USB LED", device.get_serial())
+            try:
+                if mode != self._shown:
+                    red, green, blue = modeToColor(mode)
+                    device.set_color(red=red, green=green, blue=blue)
+                    self._shown = mode
+            except Exception as e:
+                self.failures += 1
+                print("Warning: Couldn't access the BlinkStick USB LED:", e)
+                with self._cond:
+                    self.device = None
+                    self._next_attempt = time.monotonic() + self._retry_delay
+                    # Show this mode once reconnected, unless a newer mode arrived meanwhile.
+                    if self._mode is None:
+                        self._mode = mode
+                    self._busy = False
+                continue
+
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+
+def _openDevice():
+    if USE_MOCK_BLINKSTICK:
+        return MockBlinkStick(verbose=True)
+    return findBlinkStick()
+
+led_driver = LEDDriver(_openDevice)
+if led_driver.device:
+    print("Found BlinkStick USB LED", led_driver.device.get_serial())
 else:
     print("Couldn't access the BlinkStick USB LED")
+# Give the final "off" a chance to reach the LED when exiting.
+atexit.register(led_driver.flush)
 
 
-# Show the current mode, using the USB LED.
+# Show the current mode, using the USB LED. This returns immediately, without waiting for the USB device.
 # Examples for grammarMode can be "Normal", "Command", "off", "disabled", "sleeping"
 def updateLED(grammarMode = "Normal"):
-    global bstick
-    try:
-        if bstick:
-            #print("In updateLED ", grammarMode)
-            V = LED_BRIGHTNESS  # LED Brightness upto 255
-            # Set my BlinkStick LED to green (ON, Normal mode) or blue (ON, Command mode)
-            if grammarMode == "Normal":
-                bstick.set_color(red=0, green=V, blue=0)
-            elif grammarMode == "Yellow":
-                bstick.set_color(red=V, green=V, blue=0)
-            elif grammarMode == "Orange":
-                bstick.set_color(red=V, green=V/3, blue=0)
-            elif grammarMode == "Pink":
-                bstick.set_color(red=V*1.2, green=V/3, blue=V/2.5)
-            elif grammarMode == "BlueGreen":
-                bstick.set_color(red=1, green=9, blue=3)
-            elif grammarMode == "disabled":
-                # Set my BlinkStick LED to red (disabled)
-                bstick.set_color(red=V*2, green=0, blue=0)
-            elif grammarMode == "sleeping":
-                # Set my BlinkStick LED to purple (sleeping)
-                bstick.set_color(red=1, green=0, blue=0)
-            elif grammarMode == "off":
-                # Set my BlinkStick LED to black (off)
-                bstick.set_color(red=0, green=0, blue=0)
-            else:
-                bstick.set_color(red=0, green=0, blue=V*1.2)
-    except:
-        print("Warning: Couldn't access the BlinkStick USB LED")
-        pass
+    led_driver.set_mode(grammarMode)
+
+
+# Quick check of the LED driver using a mock device, that's slow and gets unplugged for a while.
+if __name__ == "__main__":
+    mock = MockBlinkStick(delay=0.05)
+    plugged_in = [True]
+    driver = LEDDriver(lambda: mock if plugged_in[0] else None, min_delay=0.05, max_delay=0.2)
+
+    start = time.perf_counter()
+    for mode in ["Normal", "Command", "Normal", "Command", "Normal", "Command", "Yellow"]:
+        driver.set_mode(mode)
+    print("7 mode changes took", '{0:.3f}'.format(1000 * (time.perf_counter() - start)), "ms on the hotkey thread")
+    driver.flush()
+    print("The LED was set", len(mock.colors), "times, and", driver.coalesced, "modes were coalesced. Final color:",
+          mock.colors[-1])
+
+    mock.unplugged = True
+    plugged_in[0] = False
+    driver.set_mode("Orange")
+    time.sleep(0.5)
+    mock.unplugged = False
+    plugged_in[0] = True
+    time.sleep(0.5)     # Give it time to reconnect
+    driver.flush()
+    print("After", driver.failures, "failure(s) and reconnecting, the final color is", mock.colors[-1])
+    driver.stop()
@@ -0,0 +1,68 @@
+# coding: utf-8
+
+# Speculative "draft" decoding: a tiny Whisper model (such as "tiny.en") transcribes each recording straight away so
+# its text can be typed or shown within a fraction of a second, then the large model transcribes the same audio and
+# the typed draft is only corrected if the large model's result differs.
+# DraftStats measures how often the draft was already right, and how much sooner the user saw the text, to decide
+# whether running 2 models is worth it on a given computer.
+
+import threading
+
+from streaming_transcription import normaliseWord
+
+
+def typing_correction(typed, final):
+    # Returns (backspaces, text): the number of characters to delete from the end of the 'typed' text, then the text
+    # to type, so that it becomes the 'final' text. Only the part after their common prefix is retyped.
+    common = 0
+    for a, b in zip(typed, final):
+        if a != b:
+            break
+        common += 1
+    return len(typed) - common, final[common:]
+
+
+def texts_agree(draft, final):
+    # Compare the words without caring about case, spacing or punctuation.
+    return [normaliseWord(w) for w in draft.split()] == [normaliseWord(w) for w in final.split()]
+
+
+class DraftStats(object):
+    '''Counts how often the draft model agreed with the large model, and how much sooner the draft text was ready.'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.agreed = 0
+        self.exact = 0                  # The typed text didn't need any correction at all
+        self.corrected_chars = 0        # Characters deleted & retyped to correct the drafts
+        self.draft_seconds = 0.0        # Total time to decode the drafts
+        self.final_seconds = 0.0        # Total time until the large model's results were ready
+        self.saved_seconds = 0.0        # Time the correct text was shown early, summed over the drafts that agreed
+
+    def record(self, draft, final, draft_seconds, final_seconds):
+        # 'draft_seconds' & 'final_seconds' are measured from the start of recognition of the same recording.
+        backspaces, retyped = typing_correction(draft, final)
+        with self._lock:
+            self.count += 1
+            self.draft_seconds += draft_seconds
+            self.final_seconds += final_seconds
+            if backspaces == 0 and not retyped:
+                self.exact += 1
+            else:
+                self.corrected_chars += backspaces + len(retyped)
+            if texts_agree(draft, final):
+                self.agreed += 1
+                self.saved_seconds += final_seconds - draft_seconds
+
+    def summary(self):
+        with self._lock:
+            if self.count == 0:
+                return "Draft model: no recordings yet."
+            return ("Draft model: agreed with the large model on " + str(self.agreed) + " of " + str(self.count) +
+                    " recordings (" + '{0:.1f}'.format(100.0 * self.agreed / self.count) + "%, " + str(self.exact) +
+                    " exactly). Drafts took " + '{0:.3f}'.format(self.draft_seconds / self.count) +
+                    " seconds on average vs " + '{0:.3f}'.format(self.final_seconds / self.count) +
+                    " seconds for the large model, showing the right text " +
+                    '{0:.3f}'.format(self.saved_seconds / self.count) + " seconds sooner per recording, with " +
+                    str(self.corrected_chars) + " characters corrected.")
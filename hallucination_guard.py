@@ -0,0 +1,227 @@
+# coding: utf-8
+
+# Detects Whisper hallucinations while the segments are still being decoded, so that a runaway decode (such as the
+# same phrase repeated over and over, or a long made-up sentence from a silent recording) is stopped straight away
+# rather than after wasting seconds of CPU/GPU time. Each new segment is checked for:
+#   - too much text for the length of the audio, or timestamps past the end of the audio,
+#   - the same few words repeated several times close together (a repetition loop),
+#   - a low average log probability together with a high probability of there being no speech,
+#   - a high compression ratio (very repetitive text compresses too well).
+# The thresholds start at Whisper's own defaults, then adapt to the user's history of accepted transcriptions, so
+# that a fast talker isn't mistaken for a hallucination. Each model has its own history & thresholds, since a small
+# model's transcriptions look different to a large model's.
+
+import os
+import json
+import threading
+import collections
+import numpy as np
+
+MAX_CHARS_PER_SECOND = 25.0     # More text than this per second of audio is suspicious ...
+MIN_SUSPICIOUS_CHARS = 40       # ... but only once there's atleast this much text
+MAX_NGRAM_REPEATS = 3           # A sequence of NGRAM_WORDS words that appears more often than this within the last
+NGRAM_WORDS = 3                 # NGRAM_WINDOW_WORDS words is a repetition loop. Phrases like "one of the" that come up
+NGRAM_WINDOW_WORDS = 30         # now and then in a long dictation are fine.
+MIN_AVG_LOGPROB = -1.0          # Whisper's default logprob_threshold
+MAX_NO_SPEECH_PROB = 0.6        # Whisper's default no_speech_threshold
+MAX_COMPRESSION_RATIO = 2.4     # Whisper's default compression_ratio_threshold
+END_TOLERANCE_SECONDS = 1.0     # Segments that end this far past the end of the audio are made up
+HISTORY_SIZE = 500              # Number of accepted transcriptions to calibrate from
+MIN_HISTORY = 20                # Use the default thresholds until there's this much history
+SAVE_DELAY_SECONDS = 30.0       # Save the history this long after a transcription is accepted, on a background thread
+DEFAULT_THRESHOLDS = {"chars_per_second": MAX_CHARS_PER_SECOND, "avg_logprob": MIN_AVG_LOGPROB,
+                      "compression_ratio": MAX_COMPRESSION_RATIO, "ngram_repeats": MAX_NGRAM_REPEATS}
+
+
+class SegmentChecker(object):
+    '''Checks each new segment of a single transcription, as it's decoded.'''
+
+    def __init__(self, guard, audio_seconds, model):
+        self.guard = guard
+        self.audio_seconds = audio_seconds
+        self.model = model
+        self.thresholds = guard.thresholds_for(model)
+        self.chars = 0
+        self.words = []
+        self.window = collections.deque()       # The n-grams in the last NGRAM_WINDOW_WORDS words
+        self.ngrams = collections.Counter()     # How often each n-gram appears in the window
+        self.max_ngram_repeats = 0
+        self.min_avg_logprob = 0.0
+        self.max_compression_ratio = 0.0
+        self.last_end = 0.0
+
+    def check(self, segment):
+        # Returns the reason that this segment looks like a hallucination, or None if it looks fine.
+        # 'segment' can be a faster-whisper Segment or an OpenAI Whisper DecodingResult.
+        thresholds = self.thresholds
+        self.chars += len(segment.text.strip())
+        end = getattr(segment, "end", None)
+        if end is not None:
+            self.last_end = end
+            if end > self.audio_seconds + END_TOLERANCE_SECONDS:
+                return "timestamps past the end of the audio"
+        if self.chars > MIN_SUSPICIOUS_CHARS and self.chars / max(self.audio_seconds, 0.1) > thresholds["chars_per_second"]:
+            return "too much text for the audio length"
+
+        new_words = [w.strip(".,!?\"'").lower() for w in segment.text.split()]
+        start = max(0, len(self.words) - NGRAM_WORDS + 1)
+        self.words.extend(new_words)
+        for i in range(start, len(self.words) - NGRAM_WORDS + 1):
+            ngram = tuple(self.words[i:i + NGRAM_WORDS])
+            self.window.append(ngram)
+            self.ngrams[ngram] += 1
+            if len(self.window) > NGRAM_WINDOW_WORDS - NGRAM_WORDS + 1:
+                self.ngrams[self.window.popleft()] -= 1
+            self.max_ngram_repeats = max(self.max_ngram_repeats, self.ngrams[ngram])
+            if self.ngrams[ngram] > thresholds["ngram_repeats"]:
+                return "repeated words"
+
+        avg_logprob = getattr(segment, "avg_logprob", None)
+        no_speech_prob = getattr(segment, "no_speech_prob", None)
+        if avg_logprob is not None:
+            self.min_avg_logprob = min(self.min_avg_logprob, avg_logprob)
+            if no_speech_prob is not None and avg_logprob < thresholds["avg_logprob"] and no_speech_prob > MAX_NO_SPEECH_PROB:
+                return "probably no speech"
+        compression_ratio = getattr(segment, "compression_ratio", None)
+        if compression_ratio is not None:
+            self.max_compression_ratio = max(self.max_compression_ratio, compression_ratio)
+            if compression_ratio > thresholds["compression_ratio"]:
+                return "text is too repetitive"
+        return None
+
+
+class HallucinationGuard(object):
+    '''Hands out a SegmentChecker for each transcription, calibrates each model's thresholds from its accepted
+    transcriptions, and keeps count of the aborted decodes & the time that saved.
+    '''
+
+    def __init__(self, history_path=None):
+        self.history_path = os.path.expanduser(history_path) if history_path else None
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()      # Only 1 thread writes the history file at a time
+        self._save_timer = None     # A pending save, so that several transcriptions in a row are saved together
+        self._histories = {}        # The accepted transcriptions of each model
+        self._thresholds = {}       # The calibrated thresholds of each model
+        self.checked = 0
+        self.aborted = collections.Counter()    # Number of aborted decodes, by reason
+        self.saved_seconds = 0.0
+        self._load_history()
+
+    def start(self, audio_seconds, model):
+        # 'model' is the name of the model doing the transcription, such as "medium.en".
+        return SegmentChecker(self, audio_seconds, model)
+
+    def thresholds_for(self, model):
+        with self._lock:
+            return self._thresholds.get(model, DEFAULT_THRESHOLDS)
+
+    def _history(self, model):
+        if model not in self._histories:
+            self._histories[model] = collections.deque(maxlen=HISTORY_SIZE)
+        return self._histories[model]
+
+    def accepted(self, checker, decode_seconds):
+        # Learn from a transcription that finished without looking like a hallucination.
+        if checker.audio_seconds <= 0 or checker.chars == 0:
+            return
+        with self._lock:
+            self.checked += 1
+            self._history(checker.model).append({"chars_per_second": checker.chars / checker.audio_seconds,
+                                                 "avg_logprob": checker.min_avg_logprob,
+                                                 "compression_ratio": checker.max_compression_ratio,
+                                                 "ngram_repeats": checker.max_ngram_repeats,
+                                                 "decode_rate": decode_seconds / checker.audio_seconds})
+            self._calibrate(checker.model)
+            # Save later on a background thread, rather than rewriting the file before this text can be typed.
+            if self.history_path and not self._save_timer:
+                self._save_timer = threading.Timer(SAVE_DELAY_SECONDS, self.flush)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+    def rejected(self, checker, reason, decode_seconds):
+        # Count an aborted decode, and estimate how long the rest of it would have taken.
+        with self._lock:
+            self.checked += 1
+            self.aborted[reason] += 1
+            rates = [h["decode_rate"] for h in self._histories.get(checker.model, [])]
+            if rates:
+                expected = float(np.median(rates)) * checker.audio_seconds
+            elif checker.last_end > 0:
+                # Without any history, assume the decode runs at a steady speed through the audio.
+                expected = decode_seconds * checker.audio_seconds / min(checker.last_end, checker.audio_seconds)
+            else:
+                expected = decode_seconds
+            saved = max(0.0, expected - decode_seconds)
+            self.saved_seconds += saved
+        return saved
+
+    def _calibrate(self, model):
+        # Loosen the model's thresholds to fit what this user's genuine speech looks like, but never tighten them
+        # beyond Whisper's defaults.
+        history = self._history(model)
+        if len(history) < MIN_HISTORY:
+            return
+        chars = [h["chars_per_second"] for h in history]
+        logprobs = [h["avg_logprob"] for h in history]
+        ratios = [h["compression_ratio"] for h in history]
+        repeats = [h.get("ngram_repeats", 0) for h in history]
+        self._thresholds[model] = {"chars_per_second": max(MAX_CHARS_PER_SECOND, 1.3 * float(np.percentile(chars, 99))),
+                                   "avg_logprob": min(MIN_AVG_LOGPROB, float(np.percentile(logprobs, 1)) - 0.2),
+                                   "compression_ratio": max(MAX_COMPRESSION_RATIO, 1.1 * float(np.percentile(ratios, 99))),
+                                   "ngram_repeats": max(MAX_NGRAM_REPEATS, int(np.ceil(np.percentile(repeats, 99))) + 1)}
+
+    def _load_history(self):
+        if not self.history_path or not os.path.exists(self.history_path):
+            return
+        try:
+            with open(self.history_path, 'r') as f:
+                histories = json.load(f)
+            if not isinstance(histories, dict):
+                print("Warning: Ignoring the old hallucination history, since it wasn't saved separately for each model.")
+                return
+            for model, history in histories.items():
+                self._history(model).extend(history)
+                self._calibrate(model)
+        except (OSError, ValueError, AttributeError) as e:
+            print("Warning: Couldn't load the hallucination history:", e)
+
+    def flush(self):
+        # Save any history that hasn't been saved yet, such as when exiting.
+        with self._lock:
+            if not self._save_timer:
+                return
+            self._save_timer.cancel()
+            self._save_timer = None
+        self._save_history()
+
+    def _save_history(self):
+        if not self.history_path:
+            return
+        with self._save_lock:
+            with self._lock:
+                histories = {model: list(history) for model, history in self._histories.items()}
+            # Write to a temporary file then rename it, so the history file is never left half written.
+            tmp_path = self.history_path + "." + str(threading.get_ident()) + ".tmp"
+            try:
+                os.makedirs(os.path.dirname(self.history_path), exist_ok=True)
+                with open(tmp_path, 'w') as f:
+                    json.dump(histories, f)
+                os.replace(tmp_path, self.history_path)
+            except OSError as e:
+                print("Warning: Couldn't save the hallucination history:", e)
+
+    def summary(self):
+        with self._lock:
+            total = sum(self.aborted.values())
+            line = "Hallucination guard: stopped " + str(total) + " of " + str(self.checked) + " decodes early"
+            if total:
+                line += " (" + ", ".join(reason + ": " + str(n) for reason, n in self.aborted.most_common()) + ")"
+                line += ", saving about " + '{0:.1f}'.format(self.saved_seconds) + " seconds of decoding"
+            line += "."
+            for model in sorted(self._histories):
+                thresholds = self._thresholds.get(model, DEFAULT_THRESHOLDS)
+                line += "\n  Thresholds for '" + model + "': " + '{0:.1f}'.format(thresholds["chars_per_second"]) + \
+                        " chars/s, avg_logprob " + '{0:.2f}'.format(thresholds["avg_logprob"]) + \
+                        ", compression ratio " + '{0:.2f}'.format(thresholds["compression_ratio"]) + ", " + \
+                        str(thresholds["ngram_repeats"]) + " repeats"
+            return line
@@ -0,0 +1,160 @@
+# coding: utf-8
+
+# Fast keyboard output of the recognised text, by emulating keypresses (or pasting from the clipboard).
+# Typing runs on its own thread, so the next transcription can start while the previous text is still being typed.
+
+import queue
+import shutil
+import subprocess
+import threading
+import time
+
+
+class PynputTyper(object):
+    '''Types text using a single reusable pynput keyboard Controller, in batches of characters
+    rather than one type() call (and sleep) per character.
+    '''
+
+    def __init__(self, controller=None, batch_size=32, batch_delay=0.005):
+        if controller is None:
+            from pynput import keyboard
+            controller = keyboard.Controller()
+        self.controller = controller
+        self.batch_size = batch_size        # Number of characters sent in each type() call
+        self.batch_delay = batch_delay      # Seconds to wait between batches, so slow apps don't drop keys
+
+    def type(self, text, cancel_event=None):
+        for i in range(0, len(text), self.batch_size):
+            if cancel_event and cancel_event.is_set():
+                return
+            self._type_batch(text[i:i + self.batch_size])
+            if self.batch_delay:
+                time.sleep(self.batch_delay)
+
+    def backspace(self, count, cancel_event=None):
+        from pynput import keyboard
+        for i in range(count):
+            if cancel_event and cancel_event.is_set():
+                return
+            self.controller.press(keyboard.Key.backspace)
+            self.controller.release(keyboard.Key.backspace)
+            if self.batch_delay and (i + 1) % self.batch_size == 0:
+                time.sleep(self.batch_delay)
+
+    def _type_batch(self, text):
+        # pynput types the characters one by one, and stops at a character that it can't type, giving its index.
+        # So skip just that character and carry on after it, without retyping the characters before it.
+        while text:
+            try:
+                self.controller.type(text)
+                return
+            except self.controller.InvalidCharacterException as e:
+                index = e.args[0]
+                print("Empty or unknown symbol", text[index])
+                text = text[index + 1:]
+
+
+class XdotoolTyper(object):
+    '''Types the whole text in a single xdotool process, which is much faster than pynput for long text (X11 only).'''
+
+    def __init__(self, delay_ms=1):
+        self.delay_ms = delay_ms
+
+    @staticmethod
+    def is_available():
+        return shutil.which("xdotool") is not None
+
+    def type(self, text, cancel_event=None):
+        if cancel_event and cancel_event.is_set():
+            return
+        subprocess.run(["xdotool", "type", "--delay", str(self.delay_ms), "--file", "-"],
+                       input=text.encode("utf-8"), check=False)
+
+    def backspace(self, count, cancel_event=None):
+        if cancel_event and cancel_event.is_set():
+            return
+        subprocess.run(["xdotool", "key", "--delay", str(self.delay_ms), "--repeat", str(count), "BackSpace"], check=False)
+
+
+class ClipboardPaster(object):
+    '''Outputs long text instantly by putting it on the clipboard and pressing Ctrl+V,
+    then restoring the previous clipboard contents.
+    '''
+
+    def __init__(self, controller=None, paste_delay=0.1):
+        if controller is None:
+            from pynput import keyboard
+            controller = keyboard.Controller()
+        self.controller = controller
+        self.paste_delay = paste_delay      # Seconds to give the app to read the clipboard before restoring it
+        self.copy_cmd, self.paste_cmd = self._find_clipboard_commands()
+
+    @staticmethod
+    def _find_clipboard_commands():
+        if shutil.which("wl-copy") and shutil.which("wl-paste"):
+            return ["wl-copy"], ["wl-paste", "--no-newline"]
+        if shutil.which("xclip"):
+            return ["xclip", "-selection", "clipboard"], ["xclip", "-selection", "clipboard", "-o"]
+        if shutil.which("xsel"):
+            return ["xsel", "--clipboard", "--input"], ["xsel", "--clipboard", "--output"]
+        return None, None
+
+    def is_available(self):
+        return self.copy_cmd is not None
+
+    def type(self, text, cancel_event=None):
+        if cancel_event and cancel_event.is_set():
+            return
+        previous = subprocess.run(self.paste_cmd, capture_output=True, check=False).stdout
+        subprocess.run(self.copy_cmd, input=text.encode("utf-8"), check=False)
+        from pynput import keyboard
+        with self.controller.pressed(keyboard.Key.ctrl):
+            self.controller.press('v')
+            self.controller.release('v')
+        time.sleep(self.paste_delay)
+        subprocess.run(self.copy_cmd, input=previous, check=False)
+
+
+class KeyboardOutput(object):
+    '''Types text on a background thread, in the order it was given.
+    Text that is at least 'paste_min_chars' long is pasted via the clipboard instead, if a paster is given.
+    '''
+
+    def __init__(self, typer, paster=None, paste_min_chars=0):
+        self.typer = typer
+        self.paster = paster
+        self.paste_min_chars = paste_min_chars
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="KeyboardOutput", daemon=True)
+        self._thread.start()
+
+    def type_text(self, text, cancel_event=None, on_done=None):
+        # Queue the text to be typed, and return immediately. If given, on_done() is called once it has been typed.
+        if text or on_done:
+            self._queue.put((0, text, cancel_event, on_done))
+
+    def correct_text(self, backspaces, text, cancel_event=None, on_done=None):
+        # Queue pressing Backspace a number of times (such as to delete the wrong end of a draft), then typing the text.
+        if backspaces or text or on_done:
+            self._queue.put((backspaces, text, cancel_event, on_done))
+
+    def wait_until_idle(self):
+        self._queue.join()
+
+    def _loop(self):
+        while True:
+            backspaces, text, cancel_event, on_done = self._queue.get()
+            try:
+                if backspaces:
+                    self.typer.backspace(backspaces, cancel_event)
+                if not text:
+                    pass
+                elif self.paster and self.paste_min_chars > 0 and len(text) >= self.paste_min_chars:
+                    self.paster.type(text, cancel_event)
+                else:
+                    self.typer.type(text, cancel_event)
+            except Exception as e:
+                print("ERROR: Couldn't type the text:", e)
+            if on_done:
+                on_done()
+            self._queue.task_done()
@@ -0,0 +1,164 @@
+# coding: utf-8
+
+# Per-utterance latency tracing of the whole dictation pipeline, from pressing the hotkey until the text was typed.
+# Each recording gets an UtteranceTrace that is marked with the time that it reached each stage. Finished traces are
+# kept in a ring buffer, and can be saved as JSON lines, exported in the Prometheus text format (as a file and/or an
+# HTTP endpoint), or printed as a rolling p50/p95 summary, to see whether the audio capture, the speech recognition
+# or the typing is the bottleneck.
+
+import os
+import json
+import time
+import threading
+import collections
+import numpy as np
+
+# The stages of the pipeline, in order.
+STAGES = ("key_down", "stream_open", "first_chunk", "key_up", "stream_closed", "audio_ready", "transcribe_start",
+          "first_segment", "last_segment", "postprocessed", "typing_done")
+
+# The spans between stages that are summarised, as (name, from_stage, to_stage).
+SPANS = (("capture start", "key_down", "stream_open"),
+         ("first audio", "stream_open", "first_chunk"),
+         ("capture stop", "key_up", "stream_closed"),
+         ("audio prep", "stream_closed", "audio_ready"),
+         ("queue wait", "audio_ready", "transcribe_start"),
+         ("first segment", "transcribe_start", "first_segment"),
+         ("remaining segments", "first_segment", "last_segment"),
+         ("postprocess", "last_segment", "postprocessed"),
+         ("typing", "postprocessed", "typing_done"),
+         ("key up to typed", "key_up", "typing_done"))
+
+
+class UtteranceTrace(object):
+    '''The times that a single recording reached each stage of the pipeline.'''
+
+    def __init__(self, trace_id):
+        self.id = trace_id
+        self.wall_time = time.time()    # When the trace started, for matching up with other logs
+        self.marks = {}                 # perf_counter() time of each stage
+        self.outcome = "typed"          # Or "skipped", "cancelled", etc
+        self.finished = False
+
+    def mark(self, stage, timestamp=None):
+        # Only the first time a stage is reached is kept.
+        if stage not in self.marks:
+            self.marks[stage] = time.perf_counter() if timestamp is None else timestamp
+
+    def span(self, from_stage, to_stage):
+        # Returns the seconds between two stages, or None if either wasn't reached.
+        if from_stage in self.marks and to_stage in self.marks:
+            return self.marks[to_stage] - self.marks[from_stage]
+        return None
+
+    def to_dict(self):
+        origin = self.marks.get("key_down", min(self.marks.values()) if self.marks else 0.0)
+        stages = {stage: round(self.marks[stage] - origin, 6) for stage in STAGES if stage in self.marks}
+        return {"id": self.id, "wall_time": self.wall_time, "outcome": self.outcome, "stages": stages}
+
+
+class LatencyTracer(object):
+    '''Collects the finished utterance traces, and exports them.'''
+
+    def __init__(self, capacity=1000, jsonl_path=None, prometheus_path=None, prometheus_port=None):
+        self._lock = threading.Lock()
+        self._traces = collections.deque(maxlen=capacity)
+        self._next_id = 0
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        if prometheus_port:
+            self._start_http_server(prometheus_port)
+
+    def start(self):
+        # Start a new trace, marking the hotkey press.
+        with self._lock:
+            trace = UtteranceTrace(self._next_id)
+            self._next_id += 1
+        trace.mark("key_down")
+        return trace
+
+    def finish(self, trace, outcome=None):
+        # Keep a finished trace. Only the first call for each trace counts, such as if it was cancelled while typing.
+        with self._lock:
+            if trace.finished:
+                return
+            trace.finished = True
+            if outcome:
+                trace.outcome = outcome
+            self._traces.append(trace)
+            if self.jsonl_path:
+                try:
+                    with open(self.jsonl_path, 'a') as f:
+                        f.write(json.dumps(trace.to_dict()) + "\n")
+                except OSError as e:
+                    print("Warning: Couldn't write the latency trace:", e)
+        if self.prometheus_path:
+            try:
+                with open(self.prometheus_path + ".tmp", 'w') as f:
+                    f.write(self.prometheus_text())
+                os.replace(self.prometheus_path + ".tmp", self.prometheus_path)
+            except OSError as e:
+                print("Warning: Couldn't write the Prometheus metrics file:", e)
+
+    def traces(self):
+        # The finished traces in the ring buffer, oldest first.
+        with self._lock:
+            return list(self._traces)
+
+    def _span_values(self):
+        traces = self.traces()
+        values = {}
+        for name, from_stage, to_stage in SPANS:
+            values[name] = [v for v in (t.span(from_stage, to_stage) for t in traces) if v is not None]
+        return values, len(traces)
+
+    def summary(self):
+        # A rolling p50/p95 summary of each span, over the traces in the ring buffer.
+        values, count = self._span_values()
+        lines = ["Latency over the last " + str(count) + " recordings (p50 / p95 in milliseconds):"]
+        for name, _, _ in SPANS:
+            v = values[name]
+            if v:
+                lines.append('  {0:<20}{1:>9.1f}{2:>9.1f}   (n={3})'.format(name, 1000 * np.percentile(v, 50),
+                                                                          1000 * np.percentile(v, 95), len(v)))
+        return "\n".join(lines)
+
+    def prometheus_text(self):
+        # The spans in the Prometheus text exposition format, as summaries with p50 & p95 quantiles.
+        values, count = self._span_values()
+        lines = ["# HELP ptt_whisper_stage_seconds Time spent in each stage of the dictation pipeline.",
+                 "# TYPE ptt_whisper_stage_seconds summary"]
+        for name, _, _ in SPANS:
+            v = values[name]
+            if not v:
+                continue
+            label = name.replace(" ", "_")
+            for q in (0.5, 0.95):
+                lines.append('ptt_whisper_stage_seconds{stage="' + label + '",quantile="' + str(q) + '"} ' +
+                             repr(float(np.percentile(v, 100 * q))))
+            lines.append('ptt_whisper_stage_seconds_sum{stage="' + label + '"} ' + repr(float(sum(v))))
+            lines.append('ptt_whisper_stage_seconds_count{stage="' + label + '"} ' + str(len(v)))
+        lines.append("# HELP ptt_whisper_utterances_traced Number of recordings in the trace buffer.")
+        lines.append("# TYPE ptt_whisper_utterances_traced gauge")
+        lines.append("ptt_whisper_utterances_traced " + str(count))
+        return "\n".join(lines) + "\n"
+
+    def _start_http_server(self, port):
+        # Serve the metrics at http://localhost:port/metrics, for scraping by Prometheus.
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        tracer = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = tracer.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass    # Don't print every request
+
+        server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="MetricsServer", daemon=True).start()
@@ -8,35 +8,135 @@
 MIC_DEVICE_INDEX = None
 
 import sys
+import threading            # For sharing the audio between threads
+import numpy as np          # For keeping the recorded audio in memory
 import pyaudio              # For audio from microphone
 import wave                 # For saving to a wav file
 import time                 # For tracking the recording length
 
+from resample import PolyphaseResampler
+from audio_io import WHISPER_RATE, CHUNK, int16_to_float32, float32_to_int16, save_wav_file_async
+
 
-CHUNK = 1024                # Record chunks of audio samples to improve efficiency
 FORMAT = pyaudio.paInt16    # Use 16-bit audio (2 bytes per sample)
 CHANNELS = 1                # We only use mono audio for speech rec
-RATE = 44100                # 44.1kHz is the most common mic sampling rate
+RATE = 44100                # Used if the mic doesn't support 16kHz and PortAudio doesn't know the mic's own default rate
+INITIAL_BUFFER_SECONDS = 30 # Preallocate enough for typical dictation, the buffer grows if needed
+KEEP_STREAM_OPEN = True     # Keep the mic stream open between recordings, to avoid the device-open delay & clipped syllables
+PREROLL_SECONDS = 0.3       # When the stream is kept open, include this much audio from just before the hotkey was pressed
+
+
+class AudioBuffer(object):
+    '''A growable sample buffer, so the audio callback never has to allocate for typical recordings.'''
+
+    def __init__(self, capacity, dtype=np.float32):
+        self._data = np.zeros(max(int(capacity), 1), dtype=dtype)
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def clear(self):
+        self._length = 0
+
+    def append(self, samples):
+        n = len(samples)
+        if self._length + n > len(self._data):
+            # Double the capacity, so that appending stays amortised O(1).
+            grown = np.zeros(max(2 * len(self._data), self._length + n), dtype=self._data.dtype)
+            grown[:self._length] = self._data[:self._length]
+            self._data = grown
+        self._data[self._length:self._length + n] = samples
+        self._length += n
+
+    def samples(self):
+        # Returns a view of the recorded samples, without copying.
+        return self._data[:self._length]
+
+
+class RingBuffer(object):
+    '''A fixed-size buffer that only keeps the most recent samples, such as the audio from just before recording starts.'''
+
+    def __init__(self, capacity, dtype=np.float32):
+        self._data = np.zeros(max(int(capacity), 1), dtype=dtype)
+        self._pos = 0           # Where the next sample will be written
+        self._filled = 0        # How many samples are valid
+
+    def clear(self):
+        self._pos = 0
+        self._filled = 0
+
+    def write(self, samples):
+        capacity = len(self._data)
+        n = len(samples)
+        if n >= capacity:
+            self._data[:] = samples[n - capacity:]
+            self._pos = 0
+            self._filled = capacity
+            return
+        end = self._pos + n
+        if end <= capacity:
+            self._data[self._pos:end] = samples
+        else:
+            split = capacity - self._pos
+            self._data[self._pos:] = samples[:split]
+            self._data[:end - capacity] = samples[split:]
+        self._pos = end % capacity
+        self._filled = min(capacity, self._filled + n)
+
+    def get(self):
+        # Returns a copy of the samples, oldest first.
+        if self._filled < len(self._data):
+            return self._data[:self._filled].copy()
+        return np.concatenate((self._data[self._pos:], self._data[:self._pos]))
+
+    def nbytes(self):
+        return self._data.nbytes
 
 
 # RecordingFile class, based on https://gist.github.com/sloria/5693955
 class RecordingFile(object):
-    '''A recorder class for recording audio to a WAV file.
-    Records in mono by default.
-    Note that if you call start_recording() & stop_recording() multiple times, it will append onto the same wav file.
+    '''A recorder class for recording audio from the mic into memory.
+    Records in mono by default. stop_recording() returns the audio as a float32 NumPy array at 16kHz,
+    ready to be passed directly to Whisper without a WAV file & ffmpeg round-trip.
+    The mic is recorded at 16kHz if it supports it, otherwise at 44.1kHz and resampled chunk by chunk as it arrives.
+    If a filename is given to start_recording(), the recording is also saved as a WAV file in the background, for debugging.
+    If keep_stream_open is True, the mic stream stays open between recordings, feeding a small ring buffer so that
+    each recording starts with 'preroll' seconds of audio from just before start_recording() was called.
     '''
 
-    def __init__(self, mode='wb'):
+    def __init__(self, mode='wb', keep_stream_open=KEEP_STREAM_OPEN, preroll=PREROLL_SECONDS):
         self.mode = mode
         self.channels = CHANNELS
-        self.rate = RATE
         self.frames_per_buffer = CHUNK
         # Initialise PyAudio (wrapper for PortAudio)
         self._pa = pyaudio.PyAudio()
         print()   # On some systems, initialising PortAudio causes a large amount of text messages to be displayed.
+        # Record at Whisper's rate if possible, otherwise resample as the audio arrives.
+        self.rate = WHISPER_RATE if self._supports_rate(WHISPER_RATE) else self._default_rate()
+        self._resampler = None
+        if self.rate != WHISPER_RATE:
+            print("Mic doesn't support " + str(WHISPER_RATE) + " Hz, so recording at " + str(self.rate) + " Hz and resampling.")
+            self._resampler = PolyphaseResampler(self.rate, WHISPER_RATE)
         self._stream = None
+        self._buffer = AudioBuffer(WHISPER_RATE * INITIAL_BUFFER_SECONDS)
+        self._buffer_lock = threading.Lock()    # Allows reading the audio while it's still being recorded
+        self._debug_fname = None
         self.time_start = None
         self.time_end = None
+        self.time_first_chunk = None    # When the first audio of the current recording arrived, for latency tracing
+        self.duration = 0.0
+
+        # Optionally keep the stream open all the time, with a ring buffer of the latest audio while we aren't recording.
+        self.keep_stream_open = keep_stream_open
+        self._recording = False
+        self._preroll = RingBuffer(int(WHISPER_RATE * preroll)) if keep_stream_open else None
+        self._callback_seconds = 0.0    # Time spent in our audio callback while idle, to measure the idle CPU cost
+        self._idle_since = None
+        self._idle_seconds = 0.0
+        if keep_stream_open:
+            self._stream = self._open_callback_stream()
+            self._idle_since = time.perf_counter()
 
     def __enter__(self):
         return self
@@ -47,46 +147,136 @@ class RecordingFile(object):
     def record_for_fixed_duration(self, duration, fname):
         # Use a stream with no callback function in blocking mode
         self.wavefile = self._prepare_file(fname, self.mode)   # Moved from the __init__ function to support new filenames
-        self._stream = self._pa.open(input_device_index=MIC_DEVICE_INDEX, format=pyaudio.paInt16,
-                                        channels=self.channels, rate=self.rate,
-                                        input=True, frames_per_buffer=self.frames_per_buffer)
+        stream = self._pa.open(input_device_index=MIC_DEVICE_INDEX, format=pyaudio.paInt16,
+                                  channels=self.channels, rate=self.rate,
+                                  input=True, frames_per_buffer=self.frames_per_buffer)
         for _ in range(int(self.rate / self.frames_per_buffer * duration)):
-            audio = self._stream.read(self.frames_per_buffer)
+            audio = stream.read(self.frames_per_buffer)
             self.wavefile.writeframes(audio)
+        stream.close()
+        self.wavefile.close()
         return None
 
-    def start_recording(self, fname):
+    def start_recording(self, fname=None):
+        # The audio is kept in memory. If fname is given, it will also be saved as a debug WAV file when recording stops.
+        self._debug_fname = fname
+        if self.keep_stream_open:
+            # The stream is already running, so just start the recording with the pre-roll audio.
+            with self._buffer_lock:
+                self.time_start = time.perf_counter()
+                self.time_first_chunk = None
+                self._idle_seconds += self.time_start - self._idle_since
+                self._buffer.clear()
+                self._buffer.append(self._preroll.get())
+                self._recording = True
+            return self
+
         # Use a stream with a callback in non-blocking mode
-        self.wavefile = self._prepare_file(fname, self.mode)   # Moved from the __init__ function to support new filenames
-        self._stream = self._pa.open(input_device_index=MIC_DEVICE_INDEX, format=pyaudio.paInt16,
-                                        channels=self.channels, rate=self.rate,
-                                        input=True, frames_per_buffer=self.frames_per_buffer,
-                                        stream_callback=self.get_callback())
-        self._stream.start_stream()
+        self._buffer.clear()
+        if self._resampler:
+            self._resampler.reset()
+        self._recording = True
+        self.time_first_chunk = None
+        self._stream = self._open_callback_stream()
         self.time_start = time.perf_counter()
         return self
 
     def stop_recording(self):
-        # Returns the elapsed recording time, in seconds.
-        self._stream.stop_stream()
-        self.time_end = time.perf_counter()
-        # Let's close our stream and wavfile, since we've moved the _prepare_file into start_recording.
-        # If we don't close the stream, each recording will cause an additional stream to stay alive without closing!
-        self._stream.close()
-        self.wavefile.close()
-        return self.time_end - self.time_start
+        # Returns the recorded audio as a float32 NumPy array at 16kHz. The elapsed recording time is kept in self.duration.
+        if self.keep_stream_open:
+            # Just take the audio from the buffer, and leave the stream running.
+            with self._buffer_lock:
+                self._recording = False
+                self.time_end = time.perf_counter()
+                self._idle_since = self.time_end
+                self._preroll.clear()
+                audio = self._buffer.samples().copy()
+        else:
+            self._stream.stop_stream()
+            self.time_end = time.perf_counter()
+            # If we don't close the stream, each recording will cause an additional stream to stay alive without closing!
+            self._stream.close()
+            self._stream = None
+            self._recording = False
+            if self._resampler:
+                self._buffer.append(self._resampler.flush())
+            # Copy the audio out of our buffer, so that it can be reused for the next recording.
+            audio = self.get_audio()
+        self.duration = self.time_end - self.time_start
+        if self._debug_fname:
+            save_wav_file_async(self._debug_fname, float32_to_int16(audio), WHISPER_RATE, self.channels)
+        return audio
 
     def get_callback(self):
         # Wraps a pyaudio callback function where we save the latest data
         def callback(in_data, frame_count, time_info, status):
-            self.wavefile.writeframes(in_data)
+            start = time.perf_counter()
+            audio = int16_to_float32(np.frombuffer(in_data, dtype=np.int16))
+            if self._resampler:
+                audio = self._resampler.process(audio)
+            with self._buffer_lock:
+                if self._recording:
+                    if self.time_first_chunk is None:
+                        self.time_first_chunk = time.perf_counter()
+                    self._buffer.append(audio)
+                else:
+                    self._preroll.write(audio)
+                    self._callback_seconds += time.perf_counter() - start
             return in_data, pyaudio.paContinue
         return callback
 
+    def get_idle_stats(self):
+        # Returns the CPU & memory cost of keeping the stream open while we aren't recording.
+        with self._buffer_lock:
+            idle_seconds = self._idle_seconds
+            if not self._recording and self._idle_since:
+                idle_seconds += time.perf_counter() - self._idle_since
+            cpu_fraction = self._callback_seconds / idle_seconds if idle_seconds > 0 else 0.0
+            preroll_bytes = self._preroll.nbytes() if self._preroll else 0
+        return {"idle_seconds": idle_seconds, "idle_callback_seconds": self._callback_seconds,
+                "idle_cpu_percent": 100.0 * cpu_fraction, "preroll_bytes": preroll_bytes}
+
+    def get_audio(self, since=0):
+        # Returns a copy of the audio recorded so far as a float32 16kHz NumPy array. Can be called while still recording.
+        # If 'since' is given, only the samples from that sample onwards are copied.
+        with self._buffer_lock:
+            return self._buffer.samples()[since:].copy()
+
+    def _open_callback_stream(self):
+        # Open & start a stream with a callback in non-blocking mode
+        stream = self._pa.open(input_device_index=MIC_DEVICE_INDEX, format=pyaudio.paInt16,
+                                  channels=self.channels, rate=self.rate,
+                                  input=True, frames_per_buffer=self.frames_per_buffer,
+                                  stream_callback=self.get_callback())
+        stream.start_stream()
+        return stream
+
+    def _input_device(self):
+        if MIC_DEVICE_INDEX is not None:
+            return MIC_DEVICE_INDEX
+        return self._pa.get_default_input_device_info()['index']
+
+    def _supports_rate(self, rate):
+        # Ask PortAudio whether the mic can record mono 16-bit audio at the given sampling rate.
+        try:
+            return self._pa.is_format_supported(rate, input_device=self._input_device(), input_channels=self.channels,
+                                                input_format=FORMAT)
+        except (ValueError, IOError):
+            return False
+
+    def _default_rate(self):
+        # The mic's own default sampling rate (such as 48kHz), which it should always support.
+        try:
+            return int(self._pa.get_device_info_by_index(self._input_device())['defaultSampleRate'])
+        except (ValueError, IOError, KeyError):
+            return RATE
+
     def close(self):
-        self._stream.close()
+        if self._stream:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
         self._pa.terminate()
-        self.wavefile.close()
 
     def _prepare_file(self, fname, mode='wb'):
         wavefile = wave.open(fname, mode)
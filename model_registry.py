@@ -0,0 +1,125 @@
+# coding: utf-8
+
+# A shared registry of loaded Whisper models, so that several hotkey profiles using the same model share a single
+# copy of it, and models that haven't been used recently are unloaded when the models would use more memory than
+# the budget. The main model can be pinned so that it's never unloaded.
+
+import gc
+import time
+import threading
+import contextlib
+import collections
+
+# Approximate number of parameters of each Whisper model size, for estimating how much memory a model uses.
+MODEL_PARAMETERS = {"tiny": 39e6, "base": 74e6, "small": 244e6, "medium": 769e6, "large": 1550e6, "turbo": 809e6}
+BYTES_PER_PARAMETER = {"float32": 4, "float16": 2, "bfloat16": 2, "int16": 2, "int8_float32": 1, "int8_float16": 1,
+                       "int8_bfloat16": 1, "int8": 1}
+
+
+def estimate_model_bytes(name, compute_type="float32"):
+    # Rough memory use of a model such as "medium.en" or "large-v3", from its size & compute type.
+    size = name.split(".")[0].split("-")[0].split("/")[-1]
+    parameters = MODEL_PARAMETERS.get(size, MODEL_PARAMETERS["medium"])
+    return int(parameters * BYTES_PER_PARAMETER.get(compute_type, 4))
+
+
+class ModelRegistry(object):
+    '''Loads each model once with load_model(name), and unloads the least recently used models that aren't being used
+    whenever the loaded models would use more than max_bytes (according to estimate_bytes(name)).
+    '''
+
+    def __init__(self, load_model, max_bytes, estimate_bytes=estimate_model_bytes):
+        self._load_model = load_model
+        self.max_bytes = max_bytes
+        self.estimate_bytes = estimate_bytes
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()      # Load 1 model at a time, so the same model isn't loaded twice
+        self._models = collections.OrderedDict()    # name -> model, least recently used first
+        self._users = collections.Counter()     # Number of transcriptions using each model right now
+        self._pinned = set()
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self.load_seconds = 0.0
+
+    def add(self, name, model, pinned=False):
+        # Register a model that was already loaded, such as the main model.
+        with self._lock:
+            self._models[name] = model
+            if pinned:
+                self._pinned.add(name)
+        self._evict(keep=name)
+
+    def loaded(self):
+        with self._lock:
+            return list(self._models)
+
+    def memory_used(self):
+        with self._lock:
+            return sum(self.estimate_bytes(name) for name in self._models)
+
+    def acquire(self, name):
+        # Returns the model, loading it first if needed. It won't be unloaded until release(name) is called.
+        with self._lock:
+            if name in self._models:
+                self.hits += 1
+                self._models.move_to_end(name)
+                self._users[name] += 1
+                return self._models[name]
+        with self._load_lock:
+            with self._lock:
+                if name in self._models:    # Another thread loaded it while we were waiting
+                    self.hits += 1
+                    self._models.move_to_end(name)
+                    self._users[name] += 1
+                    return self._models[name]
+            # Make room before loading, so that the old & new models aren't both in memory.
+            self._evict(keep=None, extra_bytes=self.estimate_bytes(name))
+            print("Loading Whisper model '" + name + "' ...")
+            start = time.perf_counter()
+            model = self._load_model(name)
+            with self._lock:
+                self.loads += 1
+                self.load_seconds += time.perf_counter() - start
+                self._models[name] = model
+                self._users[name] += 1
+            return model
+
+    def release(self, name):
+        with self._lock:
+            self._users[name] -= 1
+            if self._users[name] <= 0:
+                del self._users[name]
+        self._evict(keep=None)
+
+    @contextlib.contextmanager
+    def use(self, name):
+        model = self.acquire(name)
+        try:
+            yield model
+        finally:
+            self.release(name)
+
+    def _evict(self, keep, extra_bytes=0):
+        # Unload the least recently used models that aren't pinned or in use, until we're within the budget.
+        evicted = []
+        with self._lock:
+            used = sum(self.estimate_bytes(name) for name in self._models) + extra_bytes
+            for name in list(self._models):
+                if used <= self.max_bytes:
+                    break
+                if name == keep or name in self._pinned or self._users[name] > 0:
+                    continue
+                used -= self.estimate_bytes(name)
+                evicted.append(self._models.pop(name))
+                self.evictions += 1
+                print("Unloaded Whisper model '" + name + "' to stay within the memory budget.")
+        if evicted:
+            del evicted
+            gc.collect()
+
+    def summary(self):
+        with self._lock:
+            return ("Models: " + str(len(self._models)) + " loaded (" + ", ".join(self._models) + "), " +
+                    str(self.hits) + " reused, " + str(self.loads) + " loaded in " +
+                    '{0:.1f}'.format(self.load_seconds) + " seconds, " + str(self.evictions) + " unloaded.")
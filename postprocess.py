@@ -0,0 +1,141 @@
+# coding: utf-8
+
+# Clean up the text that Whisper recognised, before it's typed.
+# Apart from the basic clean up (whitespace, capitalisation and ending punctuation), it can apply the user's own rules:
+#   - A word replacement dictionary, such as {"pie torch": "PyTorch"}. All the replacements are compiled into a single
+#     trie-shaped regex, so each sentence is scanned once and quickly, however many thousands of entries there are.
+#   - Regex rules, as (pattern, replacement) pairs that are compiled once and applied in order.
+#   - Spoken punctuation commands, such as saying "comma" or "new line".
+
+import re
+import json
+import hashlib
+
+# Spoken punctuation commands, and the text that replaces them.
+SPOKEN_PUNCTUATION = {
+    "comma": ",",
+    "full stop": ".",
+    "period": ".",
+    "question mark": "?",
+    "exclamation mark": "!",
+    "exclamation point": "!",
+    "colon": ":",
+    "semicolon": ";",
+    "new line": "\n",
+    "new paragraph": "\n\n",
+}
+
+_SPACES = re.compile(r"[ \t]+")
+_SPACES_AROUND_NEWLINE = re.compile(r"[ \t]*\n[ \t]*")
+_NEW_SENTENCE = re.compile(r"([.?!] |\n)([a-z])")
+_SENTENCE_ENDINGS = ("?", "!", ".", ",", "\n")
+
+
+def _trie_pattern(phrases):
+    # Build a regex alternation of the phrases that shares their common prefixes, like a trie, such as "new (?:line|paragraph)".
+    # Python's regex engine tries each alternative in turn, so this keeps the matching fast with thousands of phrases.
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for character in phrase:
+            node = node.setdefault(character, {})
+        node[""] = None     # End of a phrase
+    return _node_pattern(trie)
+
+
+def _node_pattern(node):
+    # Longer continuations are tried before ending the phrase here, so the longest phrase always wins.
+    alternatives = [re.escape(character) + _node_pattern(child) for character, child in sorted(node.items()) if character]
+    if "" in node:
+        alternatives.append("")
+    if len(alternatives) == 1:
+        return alternatives[0]
+    return "(?:" + "|".join(alternatives) + ")"
+
+
+def _compile_alternation(phrases, prefix="", suffix=""):
+    # A single case-insensitive regex matching any of the whole-word phrases. Returns None if there are no phrases.
+    if not phrases:
+        return None
+    return re.compile(prefix + r"(?<!\w)(" + _trie_pattern(phrases) + r")(?!\w)" + suffix, re.IGNORECASE)
+
+
+def load_rules(fname):
+    # Load the user's rules from a JSON file such as:
+    #   {"replacements": {"pie torch": "PyTorch"}, "regex_rules": [["\\bum+\\b ?", ""]]}
+    # Returns (replacements, regex_rules).
+    with open(fname, encoding="utf-8") as f:
+        rules = json.load(f)
+    return rules.get("replacements", {}), [tuple(rule) for rule in rules.get("regex_rules", [])]
+
+
+class TextPostprocessor(object):
+    '''Cleans up the sentences that Whisper recognised, with the user's replacements and rules.
+    All the regexes are compiled once when this is created, so process() does very little work per sentence.
+    '''
+
+    def __init__(self, replacements=None, regex_rules=None, spoken_punctuation=None):
+        # Replacements are matched case-insensitively, as whole words.
+        self._replacements = {k.lower(): v for k, v in (replacements or {}).items()}
+        self._replacement_regex = _compile_alternation(self._replacements)
+        self._regex_rules = [(re.compile(pattern), replacement) for pattern, replacement in (regex_rules or [])]
+        # Whisper often adds its own punctuation around a spoken command, such as "Hello, comma, world", so swallow that.
+        self._punctuation = {k.lower(): v for k, v in (spoken_punctuation or {}).items()}
+        self._punctuation_regex = _compile_alternation(self._punctuation, prefix=r"[ \t]*[,.]?[ \t]*",
+                                                       suffix=r"[ \t]*[,.]?")
+        self._signature = hashlib.sha256(json.dumps([sorted(self._replacements.items()), regex_rules or [],
+                                                     sorted(self._punctuation.items())]).encode("utf-8")).hexdigest()
+
+    def signature(self):
+        # A short hash of all the rules, so cached transcriptions are invalidated when the rules change.
+        return self._signature[:16]
+
+    def _replace_word(self, match):
+        return self._replacements[match.group(1).lower()]
+
+    def _replace_punctuation(self, match):
+        punctuation = self._punctuation[match.group(1).lower()]
+        if punctuation.endswith("\n"):
+            return punctuation
+        return punctuation + " "
+
+    def process(self, text, end_sentence=True):
+        # Clean up a single sentence. Returns "" if there's nothing but whitespace, otherwise the sentence always
+        # ends with punctuation and a space, to easily follow up with more dictation. If end_sentence is False, the
+        # ending isn't added, such as for the start of a sentence that's still being dictated.
+        sentence = text.strip()
+        if not sentence:
+            return ""
+        if self._replacement_regex:
+            sentence = self._replacement_regex.sub(self._replace_word, sentence)
+        for regex, replacement in self._regex_rules:
+            sentence = regex.sub(replacement, sentence)
+        if "  " in sentence or "\t" in sentence:
+            sentence = _SPACES.sub(" ", sentence)
+        if self._punctuation_regex:
+            sentence, n = self._punctuation_regex.subn(self._replace_punctuation, sentence)
+            if n:
+                # Capitalise the words after a spoken full stop, question mark or new line.
+                sentence = _SPACES_AROUND_NEWLINE.sub("\n", _SPACES.sub(" ", sentence))
+                sentence = _NEW_SENTENCE.sub(lambda m: m.group(1) + m.group(2).upper(), sentence)
+        sentence = sentence.strip(" \t")
+        if not sentence:
+            return ""
+        # Capitalise the sentence
+        sentence = sentence[0].upper() + sentence[1:]
+        if not end_sentence:
+            return sentence
+        # Remove trailing "..." that Whisper sometimes includes at the end
+        if sentence.endswith("..."):
+            sentence = sentence[:-3]
+        # Make sure it ends with a fullstop or question mark or exclamation mark. Whisper is usually inconsistent about this.
+        if not sentence.endswith(_SENTENCE_ENDINGS):
+            sentence = sentence + "."
+        # Always end with a space, unless it ends with a new line
+        if not sentence.endswith("\n"):
+            sentence = sentence + " "
+        return sentence
+
+    def process_segments(self, texts):
+        # Clean up each segment (such as each sentence from faster-whisper), and join them into one string.
+        return "".join([self.process(text) for text in texts])
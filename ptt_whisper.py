@@ -3,6 +3,9 @@
 
 print("Push-to-talk for dictating with OpenAI Whisper speech recognition. By Shervin Emami 2024.\n")
 
+import time
+STARTUP_CLOCK = time.perf_counter()     # For measuring how long each stage of startup takes
+
 # Push-to-talk, using keyboard hotkeys to only use OpenAI Whisper speech recognition when asked.
 # It's usually doing nothing. Once the hotkey is pressed down, it starts recording audio.
 # Once the hotkey is released, it triggers Whisper speech recognition on that recording in the background,
@@ -37,10 +40,16 @@ BEST_OF = 5
 TEMPERATURE = 0.3
 PATIENCE = 1.0                  # Must be larger than 0
 
+# With OpenAI whisper, trim the silence before & after the speech, rather than always processing 30 seconds of audio.
+TRIM_SILENCE = True
+
 # Set to True if you want it to try using faster-whisper instead of OpenAI whisper.
 USE_FASTER_WHISPER = True
 # Defaults to using 1 CPU worker threads, but can use more, at the expense of more RAM usage.
 NUM_FASTER_WHISPER_WORKERS=1
+# When several short recordings are waiting for recognition (such as during a long recognition), faster-whisper can
+# decode upto this many of them together in a single batch, which gives more utterances per second. 1 to disable.
+MAX_BATCH_SIZE = 8
 
 # Whisper allows passing "prompt" that is intended to be the previous sentence or some similar related text, to give a hint 
 # about what it should expect. This includes formatting, so for example giving a hint of "40's" can push whisper closer to
@@ -51,6 +60,55 @@ NUM_FASTER_WHISPER_WORKERS=1
 # here we will use a fixed prompt string, formatted in the way that we like.
 HINT_PROMPT = "oh OK yeah sure, in my 40's I mostly benchmarked a profile of ARM CPU core optimisations such as on A53 CPU's"
 
+# Each dictation hotkey can have its own decoding profile, such as a fast mode for short commands and a slower but
+# more accurate mode for long prose. A profile can set "model", "language", "prompt", "beam_size", "best_of",
+# "temperature" and "patience", and uses the settings above for anything it doesn't set. For example:
+#   HOTKEY_PROFILES = {
+#       "num_lock": {},
+#       "f13": {"model": "tiny.en", "beam_size": 1, "best_of": 1, "temperature": 0.0, "prompt": ""},
+#       "f14": {"model": "large-v3", "beam_size": 5},
+#       "f15": {"model": "medium", "language": "fr", "prompt": "Bonjour, oui, d'accord."},
+#   }
+# The hotkeys are names of pynput keyboard.Key keys. Each model is loaded once & shared by all the profiles using it,
+# and the least recently used models are unloaded if they would use more than MODEL_MEMORY_BUDGET_MB of RAM (or VRAM).
+# The main model (model_filename) always stays loaded. With PRELOAD_PROFILE_MODELS, the other models are loaded during
+# startup (if they fit in the budget), otherwise they're loaded the first time their hotkey is used.
+HOTKEY_PROFILES = {"num_lock": {}}
+MODEL_MEMORY_BUDGET_MB = 4096
+PRELOAD_PROFILE_MODELS = True
+
+# Your own fixes for words that Whisper keeps getting wrong, applied to the recognised text before it's typed.
+# The replacements are whole words or phrases (ignoring case), and the regex rules are (pattern, replacement) pairs.
+# They can also be loaded from a JSON file, such as: {"replacements": {"pie torch": "PyTorch"}, "regex_rules": [["\\bum\\b,? ?", ""]]}
+TEXT_REPLACEMENTS = {}          # eg: {"pie torch": "PyTorch", "get hub": "GitHub"}
+TEXT_REGEX_RULES = []           # eg: [(r"\b[Uu]m+\b,? ?", "")]
+TEXT_RULES_FILE = None          # eg: "~/.config/push-to-whisper/rules.json"
+# Set to True to turn spoken punctuation like "comma", "full stop", "question mark" or "new line" into the symbols.
+ENABLE_SPOKEN_PUNCTUATION = False
+
+# Set to True to also load a tiny "draft" model, that quickly transcribes each recording before the main model does.
+# With DRAFT_MODE = "type", the draft text is typed straight away, and then corrected (using Backspace) if the main
+# model's result differs. With DRAFT_MODE = "hint", the draft is just shown in the console and given to the main model
+# as part of its prompt. The agreement rate & time saved are printed on exit, to see if it's worthwhile on your computer.
+ENABLE_DRAFT_MODEL = False
+DRAFT_MODEL_FILENAME = "tiny.en"    # Can be "tiny.en" or "base.en"
+DRAFT_MODE = "type"                 # Can be "type" or "hint"
+
+# Check each segment for signs of hallucination while it's being decoded (such as repeated phrases, or far too much
+# text for the audio length), and stop decoding straight away if so. The thresholds adapt to your own speech, using
+# a history of your accepted transcriptions with each model, saved in HALLUCINATION_HISTORY_FILE (set to None to not
+# save it). It's kept outside of TRANSCRIPTION_CACHE_DIR, so that clearing the cache doesn't lose it.
+ENABLE_HALLUCINATION_GUARD = True
+HALLUCINATION_HISTORY_FILE = "~/.local/share/push-to-whisper/hallucination_history.json"
+
+# Set this to the socket path of a running recognition_server.py, to use its shared Whisper model instead of loading
+# a model in this process. Then several users or sessions on the same computer only need 1 copy of the model, and
+# this starts instantly. The audio is streamed to the server while the hotkey is held down.
+RECOGNITION_SERVER_SOCKET = None    # eg: "/run/user/1000/push-to-whisper.sock"
+# Give up on a recording if the server hasn't sent its text after this many seconds, plus this many seconds per second
+# of audio, so that a hung server can't hold up the recordings after it forever.
+RECOGNITION_SERVER_TIMEOUT = 30.0
+RECOGNITION_SERVER_TIMEOUT_PER_SECOND = 2.0
 
 # If you have a BlinkStick USB-controlled RGB LED, then set this to True.
 ENABLE_BLINKSTICK = True
@@ -61,33 +119,146 @@ SHOW_ALL_KEYS = False
 # When this is True, it will type the resulting text on your keyboard. Set to False if you only want to see the results in the console.
 ENABLE_TYPING = True
 
+# How to type the text: "pynput" works everywhere, while "xdotool" is faster for long text but needs X11 and the xdotool command.
+TYPING_BACKEND = "pynput"
+# Text that is atleast this many characters long is pasted through the clipboard instead of typed, which is instant.
+# Needs xclip, xsel or wl-clipboard installed. Set to 0 to always type the text.
+CLIPBOARD_PASTE_MIN_CHARS = 0
 
+# The audio is passed to Whisper directly from memory. Set this to True to also save each recording as a WAV file
+# (in the background) for debugging, as "recording0.wav" etc in the current folder.
+SAVE_DEBUG_WAV = False
 
-import os
-import sys
-import time
-import atexit
+# Use a fast voice activity detector (VAD) to skip Whisper for accidental hotkey taps & silent recordings, and to only
+# give Whisper the part of the recording containing speech. Recordings shorter than MIN_RECORDING_SECONDS are always skipped.
+ENABLE_VAD = True
+MIN_RECORDING_SECONDS = 0.45
+
+# Recordings waiting for speech recognition are kept in RAM. If they use more than this many megabytes (such as when
+# making many recordings during a slow recognition), the newest waiting ones are moved to tmpfs (/dev/shm).
+MAX_RECORDING_MEMORY_MB = 256
+
+# Set to True to keep an on-disk cache of the transcriptions, so that identical audio transcribed with identical settings
+# (such as replaying saved recordings, or running tests) doesn't need to run Whisper again.
+ENABLE_TRANSCRIPTION_CACHE = False
+TRANSCRIPTION_CACHE_DIR = "~/.cache/push-to-whisper"
+TRANSCRIPTION_CACHE_MAX_ENTRIES = 1000     # The least recently used results are deleted beyond this
+
+# Hotkey to cancel the most recent recording that is still waiting for (or undergoing) speech recognition or typing.
+# This is the name of a pynput keyboard.Key, such as "pause", "scroll_lock" or "f12".
+CANCEL_HOTKEY = "pause"
+
+# Set to True to transcribe the audio while the hotkey is still held down (requires faster-whisper), typing the
+# words as soon as they are stable, so that only the last few words need to be decoded after releasing the hotkey.
+# This uses more CPU/GPU while recording, in exchange for much lower latency on long dictations.
+ENABLE_STREAMING = False
+STREAMING_INTERVAL = 1.0        # Seconds between the partial transcriptions while recording
 
-from pynput import keyboard     # To wait for hotkeys, and to emulate typing keypresses
+# Trace how long each stage of every dictation takes (recording, queueing, recognition, typing), to find the bottleneck.
+# Press the STATS_HOTKEY to print the p50/p95 latency of each stage. The traces can also be appended to a JSON lines
+# file, and exported for Prometheus as a text file (for node_exporter's textfile collector) or at http://localhost:PORT/metrics
+ENABLE_LATENCY_TRACING = True
+STATS_HOTKEY = "scroll_lock"
+LATENCY_TRACE_FILE = None           # eg: "latency_traces.jsonl"
+PROMETHEUS_METRICS_FILE = None      # eg: "/var/lib/node_exporter/textfile_collector/ptt_whisper.prom"
+PROMETHEUS_PORT = None              # eg: 9464
 
-from microphone import RecordingFile
 
 
-# Load the OpenAI Whisper model
-print("Please wait while we load Whisper model '" + model_filename + "' during startup, this can take a long time ...")
+import os
+import sys
+import atexit
+import bisect
+import threading
+import numpy as np
+
+# The keyboard & mic are only needed for real dictation, so headless tests (such as benchmark_e2e.py) can still
+# import this file on a server without X or PortAudio.
+try:
+    from pynput import keyboard     # To wait for hotkeys, and to emulate typing keypresses
+except Exception as e:
+    print("Warning: Couldn't load pynput, so the keyboard can't be used:", e)
+    keyboard = None
+
+from recognition_queue import RecognitionQueue
+from streaming_transcription import StreamingTranscriber
+from keyboard_output import KeyboardOutput, PynputTyper, XdotoolTyper, ClipboardPaster
+from transcription_cache import TranscriptionCache
+from silence import trim_silence, split_on_silence, WHISPER_RATE
+from recording_slots import RecordingSlotManager
+from vad import detect_speech, VadStats
+from latency_trace import LatencyTracer
+from postprocess import TextPostprocessor, load_rules, SPOKEN_PUNCTUATION
+from draft_decoding import DraftStats, typing_correction
+from recognition_client import RecognitionClient
+from hallucination_guard import HallucinationGuard, MAX_CHARS_PER_SECOND
+from model_registry import ModelRegistry, estimate_model_bytes
+
+
+# Print & keep the time since startup that a stage of the startup was reached.
+startup_times = []
+def recordStartupTime(stage):
+    elapsed = time.perf_counter() - STARTUP_CLOCK
+    startup_times.append((stage, elapsed))
+    print("[Startup: " + stage + " after", '{0:.3f}'.format(elapsed), "seconds]")
+
+recordStartupTime("imports done")
+
+
+# The Whisper model is loaded on a background thread, so that the hotkeys & mic work straight away.
+# Any recordings made before the model is ready are queued, and transcribed once it's ready.
 whisper_model = None
+model_ready = threading.Event()
+model_error = None      # Set if the model couldn't be loaded, so that recordings fail rather than waiting forever
+openai_whisper_lock = threading.Lock()  # OpenAI Whisper isn't thread-safe, so only allow 1 transcription at a time
+
 # Load either Faster-Whisper or OpenAI Whisper
-if USE_FASTER_WHISPER:
-    try:
-        USE_FASTER_WHISPER = False   # Start by assuming there was a failure.
+def loadWhisperModel():
+    global whisper_model
+    global whisper
+    global USE_FASTER_WHISPER
+    print("Loading Whisper model '" + model_filename + "' in the background, this can take a long time ...")
+    if USE_FASTER_WHISPER:
+        try:
+            USE_FASTER_WHISPER = False   # Start by assuming there was a failure.
+            from faster_whisper import WhisperModel
+            whisper_model = WhisperModel(model_filename, device=COMPUTE_DEVICE, compute_type=COMPUTE_TYPE, num_workers=NUM_FASTER_WHISPER_WORKERS)
+            USE_FASTER_WHISPER = True    # Only set the flag if we succesfully imported the library and opened the model.
+        except:
+            print("ERROR: faster_whisper not installed or not working, falling back to OpenAI whisper")
+    if not USE_FASTER_WHISPER or not whisper_model:
+        import whisper
+        whisper_model = whisper.load_model(model_filename)
+    # Share the main model with any hotkey profiles that use it, and never unload it.
+    model_registry.add(model_filename, whisper_model, pinned=True)
+
+# Load another model (such as for the draft or a hotkey profile), using the same backend as the main model.
+# So it must be called after the main model was loaded.
+def loadModelByName(name):
+    global whisper
+    if USE_FASTER_WHISPER:
         from faster_whisper import WhisperModel
-        whisper_model = WhisperModel(model_filename, device=COMPUTE_DEVICE, compute_type=COMPUTE_TYPE, num_workers=NUM_FASTER_WHISPER_WORKERS)
-        USE_FASTER_WHISPER = True    # Only set the flag if we succesfully imported the library and opened the model.
-    except:
-        print("ERROR: faster_whisper not installed or not working, falling back to OpenAI whisper")
-if not USE_FASTER_WHISPER or not whisper_model:
+        return WhisperModel(name, device=COMPUTE_DEVICE, compute_type=COMPUTE_TYPE, num_workers=NUM_FASTER_WHISPER_WORKERS)
     import whisper
-    whisper_model = whisper.load_model(model_filename)
+    return whisper.load_model(name)
+
+# The loaded models, shared by the hotkey profiles & the draft. OpenAI Whisper models always use FP32.
+model_registry = ModelRegistry(loadModelByName, MODEL_MEMORY_BUDGET_MB * 1024 * 1024,
+                               lambda name: estimate_model_bytes(name, COMPUTE_TYPE if USE_FASTER_WHISPER else "float32"))
+
+# Load the small draft model. It stays loaded, and is shared with any hotkey profile that uses the same model.
+draft_model = None
+draft_model_ready = threading.Event()
+def loadDraftModel():
+    global draft_model
+    try:
+        draft_model = model_registry.acquire(DRAFT_MODEL_FILENAME)
+    except Exception as e:
+        print("ERROR: Couldn't load the draft model, so only the main model will be used:", e)
+        draft_model = None
+
+# Faster-Whisper can run several transcriptions in parallel (one per worker).
+NUM_RECOGNITION_WORKERS = NUM_FASTER_WHISPER_WORKERS if USE_FASTER_WHISPER else 1
 
 
 # Possibly show our mode on a BlinkStick USB LED, if enabled and available.
@@ -101,63 +272,154 @@ if not ENABLE_BLINKSTICK:
         pass
 
 
-# Clean up a sentence.
+# Optionally cache the transcriptions on disk.
+transcription_cache = None
+if ENABLE_TRANSCRIPTION_CACHE:
+    transcription_cache = TranscriptionCache(TRANSCRIPTION_CACHE_DIR, TRANSCRIPTION_CACHE_MAX_ENTRIES)
+
+# The decoding settings of a hotkey profile, using the default settings for anything that the profile doesn't set.
+def getProfileSettings(profile=None):
+    settings = {"model": model_filename, "language": LANGUAGE, "prompt": HINT_PROMPT, "beam_size": BEAM_SIZE,
+                "best_of": BEST_OF, "temperature": TEMPERATURE, "patience": PATIENCE}
+    settings.update(profile or {})
+    return settings
+
+# True if the profile decodes the same way as the default settings, so its recordings can be batched, streamed, etc.
+def isDefaultProfile(profile):
+    return not profile or getProfileSettings(profile) == getProfileSettings()
+
+# All the settings that affect the transcription result, used as part of the transcription cache key.
+def getDecodingParams(settings=None):
+    settings = settings or getProfileSettings()
+    return {"backend": "faster-whisper" if USE_FASTER_WHISPER else "whisper", "model": settings["model"],
+            "compute_type": COMPUTE_TYPE, "beam_size": settings["beam_size"], "best_of": settings["best_of"],
+            "temperature": settings["temperature"], "patience": settings["patience"], "language": settings["language"],
+            "prompt": settings["prompt"], "trim_silence": TRIM_SILENCE, "postprocess": text_postprocessor.signature()}
+
+
+# Clean up the recognised text, with the user's own replacements & rules. All the rules are compiled once, here.
+text_replacements = dict(TEXT_REPLACEMENTS)
+text_regex_rules = list(TEXT_REGEX_RULES)
+if TEXT_RULES_FILE:
+    try:
+        file_replacements, file_regex_rules = load_rules(os.path.expanduser(TEXT_RULES_FILE))
+        text_replacements.update(file_replacements)
+        text_regex_rules.extend(file_regex_rules)
+    except (OSError, ValueError) as e:
+        print("ERROR: Couldn't load the text rules from '" + TEXT_RULES_FILE + "':", e)
+text_postprocessor = TextPostprocessor(text_replacements, text_regex_rules,
+                                       SPOKEN_PUNCTUATION if ENABLE_SPOKEN_PUNCTUATION else None)
+
+# Clean up a sentence. Returns "" if there's no text.
 def postprocessSentence(text):
-    sentence = text
-    # Remove initial whitespace
-    if sentence.startswith(" "):
-        sentence = sentence[1:]
-    # Remove ending whitespace
-    if sentence.endswith(" "):
-        sentence = sentence[:-1]
-    # Capitalise the sentence
-    sentence = sentence[0].upper() + sentence[1:]
-    # Remove trailing "..." that Whisper sometimes includes at the end
-    if sentence.endswith("..."):
-        sentence = sentence[:-3]
-    # Make sure it ends with a fullstop or question mark or exclamation mark, followed by a space,
-    # to easily follow up with more dictation. Whisper is usually inconsistent about this.
-    if not sentence.endswith("?") and not sentence.endswith("!") and not sentence.endswith(".") and not sentence.endswith(","):
-        sentence = sentence + "."
-    # Always end with a space
-    sentence = sentence + " "
-
-    # If the previous sentence didn't end with a question mark or exclamation mark, begin this
-    # sentence with a fullstop and a space
-    #if "?" not in result[-1] and "!" not in result[-1]:
-    #    sentence = ". " + sentence
-
-    return sentence
-
-
-# Perform speech recognition on the saved wav file
-def performSpeechRecOnFile(audio_filename):
-    # Decode the audio
-    result = ""
-    if not USE_FASTER_WHISPER:
-        audio = whisper.load_audio(audio_filename)
+    return text_postprocessor.process(text)
+
+
+# Optionally check for hallucinations while decoding.
+hallucination_guard = None
+if ENABLE_HALLUCINATION_GUARD:
+    hallucination_guard = HallucinationGuard(HALLUCINATION_HISTORY_FILE)
+    atexit.register(hallucination_guard.flush)
+
+# Stop a decode that looks like a hallucination, and report how much time that saved.
+def reportHallucination(checker, reason, start_inference):
+    saved = hallucination_guard.rejected(checker, reason, time.perf_counter() - start_inference)
+    print("Detected hallucination (" + reason + "), so stopped decoding early, saving about",
+          '{0:.3f}'.format(saved), "seconds.")
+    updateLED("Orange")    # Show the LED as Orange to signify a hallucination
+
+
+# Perform speech recognition on the recorded audio.
+# 'audio' can be a float32 NumPy array of 16kHz mono samples (as returned by RecordingFile), or the filename of an audio file.
+# If cancel_event is given and gets set, the transcription stops as soon as possible.
+# If use_cache is False, the transcription cache is skipped. If warm_up is True, the silence isn't trimmed, so that
+# the whole model runs even on a short clip.
+# If a latency trace is given, it's marked when the first & last segments are decoded.
+# The decoding settings come from the hotkey 'profile' (the defaults if None), and 'prompt' overrides its prompt.
+# 'model' defaults to the profile's model from the model registry, but can be the draft model (which shouldn't use the
+# cache, and doesn't need check_hallucinations since the main model's result replaces it).
+def performSpeechRecOnFile(audio, cancel_event=None, use_cache=True, trace=None, model=None, prompt=None, profile=None,
+                           warm_up=False, check_hallucinations=True):
+    settings = getProfileSettings(profile)
+    if prompt is not None:
+        settings["prompt"] = prompt
+    # Reuse a previous result for identical audio & settings, if the cache is enabled.
+    cache_key = None
+    if transcription_cache and use_cache:
+        cache_key = transcription_cache.make_key(audio, getDecodingParams(settings))
+        cached_result = transcription_cache.get(cache_key)
+        if cached_result is not None:
+            print("  --> ", cached_result, "(cached)")
+            if trace:
+                trace.mark("first_segment")
+                trace.mark("last_segment")
+            return cached_result
+
+    if model is None:
+        # Keep the model loaded until this transcription is done, even if another profile needs the memory.
+        with model_registry.use(settings["model"]) as model:
+            result = decodeAudio(audio, model, settings, cancel_event, trace, warm_up, check_hallucinations)
+    else:
+        result = decodeAudio(audio, model, settings, cancel_event, trace, warm_up, check_hallucinations)
+
+    if cache_key and not (cancel_event and cancel_event.is_set()):
+        transcription_cache.put(cache_key, result)
+    return result
 
-        # Pad/trim it to fit 30 seconds just like the training set.
-        audio = whisper.pad_or_trim(audio)
+
+# Decode the audio with the given model & decoding settings, returning the cleaned up text.
+# If check_hallucinations is True, each window or segment is checked by the hallucination guard as soon as it's
+# decoded, and decoding stops at the first one that looks like a hallucination, keeping just the text before it.
+# The warm-up clip isn't checked, so that it doesn't affect the guard's calibration.
+def decodeAudio(audio, model, settings, cancel_event=None, trace=None, warm_up=False, check_hallucinations=True):
+    check_hallucinations = check_hallucinations and hallucination_guard and not warm_up
+    # Decode the audio, into the text of each window or segment
+    texts = []
+    checker = None
+    hallucination = None
+    if not USE_FASTER_WHISPER:
+        if isinstance(audio, str):
+            audio = whisper.load_audio(audio)
 
         start_inference = time.perf_counter()
 
-        # Make log-mel spectrogram and move it to the same device as the model (GPU)
-        mel = whisper.log_mel_spectrogram(audio).to(whisper_model.device)
+        # Rather than padding every clip to 30 seconds, trim the silence and split long recordings into windows of
+        # upto 30 seconds at quiet moments, so the spectrogram work scales with the speech length and nothing is cut off.
+        if TRIM_SILENCE and not warm_up:
+            audio = trim_silence(audio)
+        windows = split_on_silence(audio, max_seconds=30.0)
+        if check_hallucinations:
+            checker = hallucination_guard.start(len(audio) / WHISPER_RATE, settings["model"])
 
-        # Decode using OpenAI Whisper.
         # Note that as of January 2024, OpenAI Whisper isn't optimised for FP16, so it's better to use FP32 mode.
-        options = whisper.DecodingOptions(language=LANGUAGE, fp16=False, prompt=HINT_PROMPT, best_of=BEST_OF,
-                                          beam_size=BEAM_SIZE, temperature=TEMPERATURE, patience=PATIENCE)
-        # Perform the transcription now.
-        decoder_result = whisper.decode(whisper_model, mel, options)
+        options = whisper.DecodingOptions(language=settings["language"], fp16=False, prompt=settings["prompt"],
+                                          best_of=settings["best_of"], beam_size=settings["beam_size"],
+                                          temperature=settings["temperature"], patience=settings["patience"])
+        for window in windows:
+            if cancel_event and cancel_event.is_set():
+                break
+            # Make log-mel spectrogram of just this window, then pad it to the 30 seconds that the encoder expects,
+            # and move it to the same device as the model (GPU)
+            mel = whisper.log_mel_spectrogram(window)
+            mel = whisper.pad_or_trim(mel, whisper.audio.N_FRAMES).to(model.device)
+
+            # Perform the transcription now, using OpenAI Whisper.
+            with openai_whisper_lock:
+                decoder_result = whisper.decode(model, mel, options)
+            if trace:
+                trace.mark("first_segment")
+
+            # Print the recognition result
+            print("  --> ", decoder_result.text)
+            hallucination = checker.check(decoder_result) if checker else None
+            if hallucination:
+                reportHallucination(checker, hallucination, start_inference)
+                break
+            texts.append(decoder_result.text)
+        if trace:
+            trace.mark("last_segment")
         elapsed_inference = time.perf_counter() - start_inference
 
-        # Print the recognition result
-        print("  --> ", decoder_result.text)
-        # Clean up the sentence.
-        result = postprocessSentence(decoder_result.text)
-
     else:
         start_inference = time.perf_counter()
         # We don't need a VAD algorithm since we are manually using a hotkey for start & stop of our audio.
@@ -165,63 +427,332 @@ def performSpeechRecOnFile(audio_filename):
         # Note that Faster-Whisper returns a generator and doesn't actually perform the transcription
         # until you use the 'segments' variable!
         # For more info about the options, see "https://github.com/SYSTRAN/faster-whisper/blob/master/faster_whisper/transcribe.py"
-        segments, info = whisper_model.transcribe(audio_filename, language=LANGUAGE, initial_prompt=HINT_PROMPT,
-                                          condition_on_previous_text=False, best_of=BEST_OF, beam_size=BEAM_SIZE, temperature=TEMPERATURE, patience=PATIENCE, word_timestamps=False, vad_filter=vad_filter)
-        # Perform the transcription now.
-        segments = list(segments)
+        segments, info = model.transcribe(audio, language=settings["language"], initial_prompt=settings["prompt"],
+                                          condition_on_previous_text=False, best_of=settings["best_of"], beam_size=settings["beam_size"],
+                                          temperature=settings["temperature"], patience=settings["patience"], word_timestamps=False, vad_filter=vad_filter)
+        # Perform the transcription now, one segment at a time so that a cancelled job or a hallucination can stop early.
+        if check_hallucinations and not isinstance(audio, str):
+            checker = hallucination_guard.start(len(audio) / WHISPER_RATE, settings["model"])
+        decoded_segments = []
+        for segment in segments:
+            if trace:
+                trace.mark("first_segment")
+            hallucination = checker.check(segment) if checker else None
+            if hallucination:
+                print("  --> ", segment.text)
+                reportHallucination(checker, hallucination, start_inference)
+                break
+            decoded_segments.append(segment)
+            if cancel_event and cancel_event.is_set():
+                print("Stopping the cancelled transcription.")
+                break
+        segments = decoded_segments
+        if trace:
+            trace.mark("last_segment")
         elapsed_inference = time.perf_counter() - start_inference
 
         # Print the recognition result.
         # Faster-whisper returns the results as potentially multiple segments, where each segment might be a full sentence.
         for segment in segments:
             print("  --> ", segment.text)
+            texts.append(segment.text)
 
-        # Convert the multiple sentences into a single output string.
+    # Let the guard learn what this user's genuine transcriptions look like.
+    if checker and not hallucination and not (cancel_event and cancel_event.is_set()):
+        hallucination_guard.accepted(checker, elapsed_inference)
 
-        n = len(segments)
-        if n > 0:
-            # Clean up the sentence.
-            result = postprocessSentence(segments[0].text)
+    # Clean up each sentence (or window), and convert the multiple sentences into a single output string.
+    result = text_postprocessor.process_segments(texts)
 
-        # If there are multiple sentences, perform some post-processing to merge the sentences.
-        i = 1  # Loop but skip the first sentence
-        while i < n:
-            sentence = postprocessSentence(segments[i].text)
-            ## If the previous sentence didn't end with a question mark or exclamation mark, begin this sentence with a fullstop and a space
-            #if "?" not in result[-1] and "!" not in result[-1]:
-            #    sentence = ". " + sentence
-            # Combine the modified sentences
-            result = result + sentence
-            i = i+1
+    print("[Inference clock time:", '{0:.3f}'.format(elapsed_inference), "seconds]")
+    return result
 
 
-    print("[Inference clock time:", '{0:.3f}'.format(elapsed_inference), "seconds]")
+# Perform speech recognition on several recordings at once, using faster-whisper's BatchedInferencePipeline.
+# The recordings are joined into 1 array, with a clip timestamp for each recording, so that the pipeline pads each
+# recording to 30 seconds and decodes them all as a single batch. Each recording must be atmost 30 seconds long.
+# Returns the cleaned up text of each recording, in the same order.
+batched_pipeline = None
+def performBatchSpeechRec(audios):
+    global batched_pipeline
+    from faster_whisper import BatchedInferencePipeline    # Needs faster-whisper 1.1 or later
+
+    # Reuse previous results from the cache, and only decode the rest.
+    results = [None] * len(audios)
+    cache_keys = [None] * len(audios)
+    if transcription_cache:
+        for i, audio in enumerate(audios):
+            cache_keys[i] = transcription_cache.make_key(audio, getDecodingParams())
+            results[i] = transcription_cache.get(cache_keys[i])
+    todo = [i for i in range(len(audios)) if results[i] is None]
+    if not todo:
+        return results
+
+    if batched_pipeline is None:
+        batched_pipeline = BatchedInferencePipeline(whisper_model)
+    starts = []         # The start time (in seconds) of each recording in the joined audio
+    clips = []
+    offset = 0
+    for i in todo:
+        starts.append(offset / float(WHISPER_RATE))
+        clips.append({"start": offset / float(WHISPER_RATE), "end": (offset + len(audios[i])) / float(WHISPER_RATE)})
+        offset += len(audios[i])
+
+    start_inference = time.perf_counter()
+    segments, info = batched_pipeline.transcribe(np.concatenate([audios[i] for i in todo]), language=LANGUAGE,
+                                                 initial_prompt=HINT_PROMPT, beam_size=BEAM_SIZE, best_of=BEST_OF,
+                                                 patience=PATIENCE, temperature=TEMPERATURE, without_timestamps=True,
+                                                 vad_filter=False, clip_timestamps=clips, batch_size=len(todo))
+    # Each segment belongs to the recording that its middle is in.
+    texts = [[] for _ in todo]
+    for segment in segments:
+        texts[bisect.bisect_right(starts, (segment.start + segment.end) / 2.0) - 1].append(segment.text)
+    elapsed_inference = time.perf_counter() - start_inference
+
+    for i, recording_texts in zip(todo, texts):
+        print("  --> ", "".join(recording_texts))
+        results[i] = text_postprocessor.process_segments(recording_texts)
+        if cache_keys[i]:
+            transcription_cache.put(cache_keys[i], results[i])
+    print("[Inference clock time:", '{0:.3f}'.format(elapsed_inference), "seconds for a batch of", len(todo), "recordings]")
+    return results
+
+
+# Transcribe audio with word timestamps, for incremental transcription while the hotkey is still held down.
+def transcribeWords(audio, prompt):
+    segments, info = whisper_model.transcribe(audio, language=LANGUAGE, initial_prompt=prompt,
+                                      condition_on_previous_text=False, best_of=BEST_OF, beam_size=BEAM_SIZE, temperature=TEMPERATURE, patience=PATIENCE, word_timestamps=True, vad_filter=False)
+    words = []
+    for segment in segments:
+        words.extend(segment.words or [])
+    return words
+
+
+# Create the keyboard output engine, which types the text on its own thread.
+def createKeyboardOutput():
+    typer = None
+    if TYPING_BACKEND == "xdotool":
+        if XdotoolTyper.is_available():
+            typer = XdotoolTyper()
+        else:
+            print("ERROR: xdotool isn't installed, falling back to typing with pynput")
+    if not typer:
+        typer = PynputTyper()
+    paster = None
+    if CLIPBOARD_PASTE_MIN_CHARS > 0:
+        paster = ClipboardPaster()
+        if not paster.is_available():
+            print("ERROR: No clipboard tool (xclip, xsel or wl-clipboard) found, so long text will be typed instead")
+            paster = None
+    return KeyboardOutput(typer, paster, CLIPBOARD_PASTE_MIN_CHARS)
+
+keyboard_output = None     # Created by main(), so that importing this file doesn't need a keyboard or mic
+
+
+# Queue the phrase to be typed on the keyboard. This returns immediately, and the phrases are typed in order.
+def typeOnKeyboard(phrase, cancel_event=None):
+    keyboard_output.type_text(phrase, cancel_event)
+
+
+# Keep the mic recording device open at all times, for faster starting & stopping. Created by main().
+rec_file = None
+file_counter = 0
+# Each recording gets its own numbered slot in memory, released once its recognition & typing is done.
+recording_slots = RecordingSlotManager(MAX_RECORDING_MEMORY_MB * 1024 * 1024)
+recording_slot = None       # The slot for the current recording
+vad_stats = VadStats()
+draft_stats = DraftStats()
+latency_tracer = None
+if ENABLE_LATENCY_TRACING:
+    latency_tracer = LatencyTracer(jsonl_path=LATENCY_TRACE_FILE, prometheus_path=PROMETHEUS_METRICS_FILE,
+                                   prometheus_port=PROMETHEUS_PORT)
+recording_trace = None      # The latency trace of the current recording
+recognition_client = None   # The connection to the recognition server, if one is used
+remote_utterance = None     # The current recording being streamed to the recognition server
+streaming_transcriber = None    # The incremental transcriber for the current recording, if streaming is being used
+recording_profile = None    # The hotkey profile of the current recording, or None for the default settings
+
+
+# Output the text that the streaming transcriber found to be stable, while the user is still speaking. The committed
+# text is cleaned up the same way as the final text (except for the sentence ending), and since a replacement or
+# spoken punctuation can change the end of it once more words arrive, only the part that changed is retyped.
+# Returns the text that is now typed.
+def outputStreamingText(typed_text, committed_text):
+    text = text_postprocessor.process(committed_text, end_sentence=False)
+    backspaces, new_text = typing_correction(typed_text, text)
+    print("  ~~> ", new_text)
+    if ENABLE_TYPING:
+        keyboard_output.correct_text(backspaces, new_text)
+    return text
+
+
+# Wait for the model, in case a recording was made during startup. Raises an error if the model couldn't be loaded.
+def waitForModel():
+    if not model_ready.is_set():
+        print("Waiting for the Whisper model to finish loading ...")
+        model_ready.wait()
+    if model_error:
+        raise RuntimeError("The Whisper model couldn't be loaded: " + str(model_error))
+
+
+# Run on a recognition worker thread. Returns the text to type for this recording.
+def recognizeRecording(job):
+    waitForModel()
+
+    if job.trace:
+        job.trace.mark("transcribe_start")
+
+    if job.streaming_transcriber:
+        result = finishStreamingRecognition(job)
+    elif job.remote:
+        # The recognition server is transcribing it, so just wait for the text.
+        result = job.remote.result(RECOGNITION_SERVER_TIMEOUT + RECOGNITION_SERVER_TIMEOUT_PER_SECOND * job.duration)
+        if job.trace:
+            job.trace.mark("first_segment")
+            job.trace.mark("last_segment")
+        result = checkRecognitionResult(job, result)
+    else:
+        # Perform speech recognition on the recorded audio, possibly starting with a quick draft. The draft is only
+        # used for the default profile, since other profiles might use a different language or a faster model anyway.
+        start_inference = time.perf_counter()
+        draft = None
+        prompt = None
+        if draft_model_ready.is_set() and isDefaultProfile(job.profile):
+            draft = recognizeDraft(job)
+            if DRAFT_MODE == "hint" and draft:
+                prompt = HINT_PROMPT + " " + draft
+            draft_seconds = time.perf_counter() - start_inference
+        result = performSpeechRecOnFile(job.audio, job.cancelled, trace=job.trace, prompt=prompt, profile=job.profile)
+        vad_stats.record_inference(time.perf_counter() - start_inference)
+        result = checkRecognitionResult(job, result)
+        if draft is not None and not job.is_cancelled():
+            draft_stats.record(draft, result, draft_seconds, time.perf_counter() - start_inference)
+
+    if job.trace:
+        job.trace.mark("postprocessed")
     return result
 
 
-def typeOnKeyboard(phrase):
-    keyb = keyboard.Controller()
-    for character in phrase:
+# Quickly transcribe the recording with the draft model, and possibly type it straight away. Returns the draft text.
+def recognizeDraft(job):
+    draft = performSpeechRecOnFile(job.audio, job.cancelled, use_cache=False, model=draft_model, check_hallucinations=False)
+    draft = checkRecognitionResult(job, draft)
+    print("  ~~> ", draft, "(draft)")
+    # Only type the draft if all the earlier recordings have already been output, so the text stays in order.
+    # It will be corrected once the main model's result is output, or deleted if the recording gets cancelled. So it's
+    # always typed in full, even if the recording gets cancelled while it's being typed.
+    if DRAFT_MODE == "type" and ENABLE_TYPING and draft and not job.is_cancelled() and recognition_queue.is_next_output(job):
+        job.typed_early = draft
+        keyboard_output.type_text(draft)
+    return draft
+
+
+# Run on a recognition worker thread, when several recordings were waiting. Returns the text to type for each recording.
+def recognizeRecordingBatch(jobs):
+    waitForModel()
+
+    # Only short, normal recordings using the default profile can be batched together. Any others are recognised one at a time.
+    batchable = [job for job in jobs if USE_FASTER_WHISPER and not job.streaming_transcriber and not job.remote
+                 and isDefaultProfile(job.profile) and len(job.audio) <= 30 * WHISPER_RATE]
+    batch_results = {}
+    if len(batchable) > 1:
+        print("Recognising a batch of", len(batchable), "queued recordings together.")
         try:
-            keyb.type(character)
-            time.sleep(0.0025)
-        except:
-            print("Empty or unknown symbol", character)
-            continue
-
+            for job in batchable:
+                if job.trace:
+                    job.trace.mark("transcribe_start")
+            for job, result in zip(batchable, performBatchSpeechRec([job.audio for job in batchable])):
+                batch_results[job.seq] = checkRecognitionResult(job, result)
+                if job.trace:
+                    # The whole batch is decoded at once, so all its segments arrive together.
+                    job.trace.mark("first_segment")
+                    job.trace.mark("last_segment")
+                    job.trace.mark("postprocessed")
+        except Exception as e:
+            print("ERROR: Batched recognition failed, so recognising the recordings one at a time:", e)
+            batch_results = {}
+
+    results = []
+    for job in jobs:
+        if job.seq in batch_results:
+            results.append(batch_results[job.seq])
+        else:
+            results.append(recognizeRecording(job))
+    return results
+
+
+# Check that the recognised text is plausible for the recording, returning the text to type.
+def checkRecognitionResult(job, result):
+    # Ensure we had enough time to say a word
+    if job.duration < MIN_RECORDING_SECONDS:
+        result = ""
 
-# Keep the mic recording device open at all times, for faster starting & stopping    
-rec_file = RecordingFile()
-file_counter = 0
-audio_filename = ""
-recognitions_in_progress = 0    # A counter of how many recognitions are currently in progress. Should usually be 0 or 1.
+    # Check if we have a lot of generated text from a very short audio recording, since this usually means Whisper
+    # has been hallucinating. Also check if the number of characters per second is very high. This catches the
+    # transcriptions that the hallucination guard didn't see, such as batched or remote recognition.
+    max_chars_per_second = MAX_CHARS_PER_SECOND
+    if hallucination_guard:
+        max_chars_per_second = hallucination_guard.thresholds_for(getProfileSettings(job.profile)["model"])["chars_per_second"]
+    chars_per_second = len(result) / job.duration
+    if (chars_per_second > max_chars_per_second and len(result) > 40):
+        result = ""
+        print("Detected hallucination!")
+        updateLED("Orange")    # Show the LED as Orange to signify a hallucination
+    return result
 
 
-def startDictation():
+# Transcribe just the unstable tail of a recording that was partially transcribed while the hotkey was held down.
+def finishStreamingRecognition(job):
+    committed_text, tail_text = job.streaming_transcriber.finish(job.audio)
+    if job.trace:
+        job.trace.mark("first_segment")
+        job.trace.mark("last_segment")
+    print("  --> ", tail_text)
+    # Check & clean up the whole text. The text that was already typed is corrected to it when it's output, the same
+    # way as a draft, so only the part after their common prefix is retyped (or all of it is deleted if it's dropped).
+    job.typed_early = job.streaming_transcriber.typed_text
+    return checkRecognitionResult(job, postprocessSentence(committed_text + tail_text))
+
+
+# Run on the recognition output thread, strictly in the order that the recordings were made.
+def outputRecognitionResult(job):
+    on_done = None
+    if job.trace:
+        def on_done():
+            job.trace.mark("typing_done")
+            latency_tracer.finish(job.trace, "cancelled" if job.is_cancelled() else ("typed" if job.result else "empty"))
+    if ENABLE_TYPING and job.typed_early:
+        # Only retype the end of the draft (or the streamed text) that differs from the final result.
+        backspaces, text = typing_correction(job.typed_early, job.result)
+        if backspaces:
+            print("Correcting the early text: deleting", backspaces, "characters and typing '" + text + "'")
+        keyboard_output.correct_text(backspaces, text, job.cancelled, on_done)
+    elif ENABLE_TYPING:
+        keyboard_output.type_text(job.result, job.cancelled, on_done)
+    elif on_done:
+        on_done()
+
+
+# Run on the recognition output thread instead of outputRecognitionResult() for a cancelled recording, to delete any
+# text that was already typed for it (a draft, or the words typed while streaming).
+def discardRecognitionResult(job):
+    typed = len(job.streaming_transcriber.typed_text if job.streaming_transcriber else job.typed_early)
+    if ENABLE_TYPING and typed:
+        print("Deleting the", typed, "characters that were typed before recording", job.seq, "was cancelled.")
+        keyboard_output.correct_text(typed, "")
+
+
+# Recordings are queued for speech recognition in the background, so the hotkey listener is never blocked by Whisper.
+# Created by main().
+recognition_queue = None
+
+
+# Start recording, to be decoded with the profile of the given dictation hotkey (the default settings if None).
+def startDictation(hotkey=None):
     global rec_file
     global file_counter
-    global audio_filename
-    global recognitions_in_progress
+    global recording_slot
+    global recording_profile
 
     # Mute the mic for my other speech recognition system, since we want to handle the mic instead.
     #try:
@@ -229,28 +760,66 @@ def startDictation():
     #except:
     #    pass
 
-    if recognitions_in_progress > 0:
-        print("User is trying to record something while recognition is still running. We'll move to a separate audio file.")
+    global streaming_transcriber
+    global recording_trace
+    global remote_utterance
+
+    recording_trace = latency_tracer.start() if latency_tracer else None
 
-    # Start recording the mic audio into our wav file
-    audio_filename = "recording" + str(recognitions_in_progress) + ".wav"
-    print("Recording to '" + audio_filename + "'...")
+    recognitions_in_progress = recognition_queue.pending()
+    if recognitions_in_progress > 0:
+        print("User is trying to record something while recognition is still running. It will be queued after the",
+              recognitions_in_progress, "previous recording(s).")
+
+    recording_profile = HOTKEY_PROFILES.get(hotkey) or None
+    if recording_profile:
+        print("Using the '" + hotkey + "' profile:", recording_profile)
+        if recognition_client:
+            print("Note: The recognition server decodes with its own settings, not the profile's.")
+
+    # Start recording the mic audio into memory, and possibly also into a debug wav file
+    recording_slot = recording_slots.allocate()
+    audio_filename = None
+    if SAVE_DEBUG_WAV:
+        audio_filename = "recording" + str(recording_slot.id) + ".wav"
+        print("Recording to '" + audio_filename + "'...")
+    else:
+        print("Recording ...")
     rec_file.start_recording(audio_filename)
+    if recording_trace:
+        recording_trace.mark("stream_open")
+
+    # Stream the audio to the recognition server while recording, if we're using one.
+    remote_utterance = recognition_client.begin(rec_file.get_audio) if recognition_client else None
+
+    # Only stream when nothing else is waiting to be typed, otherwise the early text would be typed out of order.
+    streaming_transcriber = None
+    if ENABLE_STREAMING and USE_FASTER_WHISPER and whisper_model and model_ready.is_set() and recognitions_in_progress == 0 \
+            and isDefaultProfile(recording_profile):
+        streaming_transcriber = StreamingTranscriber(transcribeWords, rec_file.get_audio, outputStreamingText,
+                                                     STREAMING_INTERVAL, HINT_PROMPT).start()
 
 def stopDictation():
     global rec_file
     global file_counter
-    global audio_filename
-    global recognitions_in_progress
+    global recording_slot
 
-    recognitions_in_progress = recognitions_in_progress + 1
     # Keep a local copy of the value for this iteration. If the user runs dictation during recognition, the global value will change.
-    this_audio_filename = audio_filename
-
-    # Save the file
-    duration = rec_file.stop_recording()
+    this_slot = recording_slot
+    trace = recording_trace
+    remote = remote_utterance
+    profile = recording_profile
+    if trace:
+        trace.mark("key_up")
+
+    # Stop recording
+    audio = rec_file.stop_recording()
+    duration = rec_file.duration
+    if trace:
+        if rec_file.time_first_chunk:
+            trace.mark("first_chunk", rec_file.time_first_chunk)
+        trace.mark("stream_closed")
     #file_counter = file_counter + 1   # Do we want to record into a new file each time?
-    print("Saved", '{0:.3f}'.format(duration), "seconds into '" + this_audio_filename + "'.")
 
     # Unmute the mic for my other speech recognition system, since we are done for now.
     #try:
@@ -258,26 +827,67 @@ def stopDictation():
     #except:
     #    pass
 
-    # Perform speech recognition on the saved wav file
-    result = performSpeechRecOnFile(this_audio_filename)
+    # Stop the partial transcriptions, since the rest of the recording will be handled by the recognition queue.
+    if streaming_transcriber:
+        streaming_transcriber.stop()
+
+    # Skip Whisper for accidental taps & silent recordings, otherwise only keep the speech. This isn't done when
+    # streaming, since some of the recording might have already been typed.
+    speech = None
+    if ENABLE_VAD and not streaming_transcriber:
+        speech = detect_speech(audio) if duration >= MIN_RECORDING_SECONDS else None
+        vad_stats.record_check(len(audio) / WHISPER_RATE, (speech[1] - speech[0]) / WHISPER_RATE if speech else None)
+        if not speech:
+            print("No speech detected in the", '{0:.3f}'.format(duration), "second recording, so skipping Whisper.")
+            this_slot.release()
+            if remote:
+                remote.cancel()
+            if trace:
+                latency_tracer.finish(trace, "skipped")
+            return
+
+    # Send the rest of the recording to the recognition server, which only needs to transcribe the speech.
+    if remote:
+        remote.finish(audio, speech)
+    if speech:
+        audio = audio[speech[0]:speech[1]]
+
+    # Keep the audio in this recording's slot in memory
+    this_slot.set_audio(audio)
+    if trace:
+        trace.mark("audio_ready")
+    print("Recorded", '{0:.3f}'.format(duration), "seconds into slot", str(this_slot.id) + ".",
+          recording_slots.live_slots(), "recording(s) in memory.")
+
+    # Queue the speech recognition & typing, without waiting for it.
+    recognition_queue.submit(this_slot, duration, streaming_transcriber, trace, remote, profile)
+
+def cancelDictation():
+    # Cancel the most recent recording that hasn't finished being recognised & typed.
+    job = recognition_queue.cancel_latest()
+    if job:
+        print("Cancelled recording", job.seq, "(" + '{0:.3f}'.format(job.duration) + " seconds).")
+        if job.trace:
+            latency_tracer.finish(job.trace, "cancelled")
+        if job.remote:
+            job.remote.cancel()
+        updateLED("Pink")    # Show the LED as Pink to signify a cancellation
+    else:
+        print("Nothing to cancel.")
 
-    # Ensure we had enough time to say a word
-    if duration < 0.45:
-        result = ""
 
-    # Check if we have a lot of generated text from a very short audio recording, since this usually means Whisper
-    # has been hallucinating. Also check if the number of characters per second is very high.
-    chars_per_second = len(result) / duration
-    if (chars_per_second > 25 and len(result) > 40):
-        result = ""
-        print("Detected hallucination!")
-        updateLED("Orange")    # Show the LED as Orange to signify a hallucination
 
-    if ENABLE_TYPING:
-        typeOnKeyboard(result)
-
-    recognitions_in_progress = recognitions_in_progress - 1    
+# What to do when the dictation hotkey is pressed & released, whether it's the real keyboard or a scripted hotkey source.
+def dictationKeyPressed(hotkey=None):
+    updateLED("Normal")
+    startDictation(hotkey)
 
+def dictationKeyReleased():
+    if model_error:
+        updateLED("disabled")
+    else:
+        updateLED("Command" if model_ready.is_set() else "Loading")
+    stopDictation()
 
 
 # Hotkey listening functionality, taken from my "_dictation_mode.py" file.
@@ -289,24 +899,51 @@ def setupHotkeysForBackends_blocking(arg):
     def on_activate():
         print('Global hotkey activated')
 
+    # The dictation hotkeys, and the name of each one's profile.
+    dictation_keys = {}
+    for name in HOTKEY_PROFILES:
+        if hasattr(keyboard.Key, name):
+            dictation_keys[getattr(keyboard.Key, name)] = name
+        else:
+            print("ERROR: Unknown dictation hotkey '" + name + "' in HOTKEY_PROFILES")
+    held_key = [None]   # The dictation hotkey that is currently held down
+    # Look up the other hotkeys once, since a bad name would stop the listener if it was looked up on each key press.
+    cancel_key = None
+    if hasattr(keyboard.Key, CANCEL_HOTKEY):
+        cancel_key = getattr(keyboard.Key, CANCEL_HOTKEY)
+    else:
+        print("ERROR: Unknown cancel hotkey '" + CANCEL_HOTKEY + "' in CANCEL_HOTKEY")
+    stats_key = None
+    if hasattr(keyboard.Key, STATS_HOTKEY):
+        stats_key = getattr(keyboard.Key, STATS_HOTKEY)
+    else:
+        print("ERROR: Unknown stats hotkey '" + STATS_HOTKEY + "' in STATS_HOTKEY")
+
     def key_pressed(a):
         if SHOW_ALL_KEYS:
             print('key pressed:', a)
-        # If the user is holding down the NumLock (Num Lock) key, switch to Dictation mode.
-        if a == keyboard.Key.num_lock:
-            updateLED("Normal")
-            print()
-            print('Global dictation-mode hotkey pressed:', a)
-            startDictation()
+        # If the user is holding down a dictation hotkey (such as NumLock), switch to Dictation mode with its profile.
+        # Key repeats, and other dictation hotkeys pressed during the recording, are ignored.
+        if a in dictation_keys:
+            if held_key[0] is None:
+                held_key[0] = a
+                print()
+                print('Global dictation-mode hotkey pressed:', a)
+                dictationKeyPressed(dictation_keys[a])
+        elif cancel_key and a == cancel_key:
+            print('Global cancel hotkey pressed:', a)
+            cancelDictation()
+        elif latency_tracer and stats_key and a == stats_key:
+            print(latency_tracer.summary())
 
     def key_released(a):
         if SHOW_ALL_KEYS:
             print('key released!', a)
-        # If the user released the NumLock (Num Lock) key, switch back to Command mode.
-        if a == keyboard.Key.num_lock:
-            updateLED("Command")
+        # If the user released the dictation hotkey, switch back to Command mode.
+        if a == held_key[0]:
+            held_key[0] = None
             print('Global dictation-mode hotkey released:', a)
-            stopDictation()
+            dictationKeyReleased()
 
         #elif a == keyboard.Key.num_lock:
         #    print('Global hotkey released!', a)
@@ -329,6 +966,8 @@ def setupHotkeysForBackends_blocking(arg):
     with keyboard.Listener(
             on_press=key_pressed,
             on_release=key_released) as h:
+        h.wait()
+        recordStartupTime("hotkey listener ready")
         h.join()
 
 
@@ -337,19 +976,125 @@ def main(args):
     # Call our onExit function before closing, since we usually run forever.
     atexit.register(onExit)
 
-    # Since the first invocation of Whisper is significantly slower than others,
-    # let's transcribe some initial data just to warm up Whisper.
-    print("Initialising OpenAI Whisper ...")
-    performSpeechRecOnFile("ready.wav")
-    updateLED("Yellow")
+    from microphone import RecordingFile
+    startPipeline(RecordingFile(), createKeyboardOutput())
 
     # Allow switching recognition backends
     setupHotkeysForBackends_blocking(0,)    # Blocking
 
     # Should never reach here!
 
+# Set up the audio source (such as the mic), the keyboard output, and the recognition queue, then load the model.
+# The audio source can be anything with the same interface as RecordingFile, such as replay.ReplayAudioSource.
+def startPipeline(audio_source, output):
+    global rec_file
+    global keyboard_output
+    global recognition_queue
+
+    rec_file = audio_source
+    keyboard_output = output
+    recognition_queue = RecognitionQueue(recognizeRecording, outputRecognitionResult, NUM_RECOGNITION_WORKERS,
+                                         recognizeRecordingBatch, MAX_BATCH_SIZE, discardRecognitionResult)
+
+    # Use the shared model of a recognition server if there is one, so there's no model to load.
+    if connectToRecognitionServer():
+        return
+
+    # Load & warm up the model in the background, while the hotkeys are already working.
+    updateLED("Loading")
+    threading.Thread(target=loadAndWarmUpModel, name="ModelLoader", daemon=True).start()
+
+# Returns True if we connected to the recognition server, otherwise we need to load our own model.
+def connectToRecognitionServer():
+    global recognition_client
+    if not RECOGNITION_SERVER_SOCKET:
+        return False
+    try:
+        recognition_client = RecognitionClient(RECOGNITION_SERVER_SOCKET)
+    except OSError as e:
+        print("ERROR: Couldn't connect to the recognition server at '" + RECOGNITION_SERVER_SOCKET + "', so loading"
+              " our own Whisper model instead:", e)
+        return False
+    print("Using the recognition server at '" + RECOGNITION_SERVER_SOCKET + "'")
+    model_ready.set()
+    updateLED("Yellow")
+    recordStartupTime("connected to the recognition server")
+    return True
+
+# Since the first invocation of Whisper is significantly slower than others, transcribe some initial data just to
+# warm up Whisper. The cache is skipped, since the whole point is to run the model.
+def warmUpModel(model=None, profile=None):
+    performSpeechRecOnFile("ready.wav", use_cache=False, model=model, profile=profile, warm_up=True)
+
+# Run on a background thread during startup.
+def loadAndWarmUpModel():
+    global model_error
+    try:
+        loadWhisperModel()
+        recordStartupTime("model loaded")
+
+        print("Initialising OpenAI Whisper ...")
+        warmUpModel()
+        recordStartupTime("model warmed up")
+    except Exception as e:
+        print("ERROR: Couldn't load the Whisper model, so dictation is disabled:", e)
+        model_error = e
+        model_ready.set()       # Let the queued recordings fail, instead of waiting for the model forever
+        updateLED("disabled")
+        return
+
+    model_ready.set()
+    updateLED("Yellow")
+    recordStartupTime("ready for dictation")
+
+    if ENABLE_DRAFT_MODEL:
+        loadDraftModel()
+        if draft_model:
+            warmUpModel(model=draft_model)
+            draft_model_ready.set()
+            recordStartupTime("draft model ready")
+
+    if PRELOAD_PROFILE_MODELS:
+        preloadProfileModels()
+
+# Load & warm up the models of the hotkey profiles, as long as they fit in the memory budget, so that the first use
+# of each hotkey doesn't need to wait for its model to load.
+def preloadProfileModels():
+    for hotkey, profile in HOTKEY_PROFILES.items():
+        name = getProfileSettings(profile)["model"]
+        if name in model_registry.loaded():
+            continue
+        if model_registry.memory_used() + model_registry.estimate_bytes(name) > model_registry.max_bytes:
+            print("Not preloading the '" + name + "' model of the '" + hotkey + "' profile, since it doesn't fit in",
+                  "MODEL_MEMORY_BUDGET_MB. It will be loaded when needed.")
+            continue
+        try:
+            warmUpModel(profile=profile)
+            recordStartupTime("'" + hotkey + "' profile model ready")
+        except Exception as e:
+            print("ERROR: Couldn't load the '" + name + "' model of the '" + hotkey + "' profile:", e)
+
 def onExit():
     #pa.terminate()  # Close PyAudio
+    if recognition_queue:
+        recognition_queue.shutdown()
+    if rec_file and rec_file.keep_stream_open:
+        stats = rec_file.get_idle_stats()
+        print("Mic stream was idle for", '{0:.1f}'.format(stats["idle_seconds"]), "seconds, using",
+              '{0:.3f}'.format(stats["idle_cpu_percent"]) + "% of a CPU core and",
+              stats["preroll_bytes"], "bytes for the pre-roll buffer.")
+    if ENABLE_VAD:
+        print(vad_stats.summary())
+    if ENABLE_DRAFT_MODEL:
+        print(draft_stats.summary())
+    if hallucination_guard:
+        print(hallucination_guard.summary())
+    if len(HOTKEY_PROFILES) > 1:
+        print(model_registry.summary())
+    if transcription_cache:
+        print(transcription_cache.stats())
+    if latency_tracer:
+        print(latency_tracer.summary())
     print("Finished listening for keyboard hotkeys.")
     updateLED("off")
 
@@ -0,0 +1,150 @@
+# coding: utf-8
+
+# The client side of recognition_server.py: streams each recording to the shared recognition daemon over its Unix
+# socket while the hotkey is still held down, then waits for the transcript. So the push-to-talk client doesn't need
+# to load a Whisper model, and starts instantly.
+
+import json
+import socket
+import threading
+
+from audio_io import float32_to_int16
+from recognition_server import send_message, recv_message, MSG_START, MSG_AUDIO, MSG_END, MSG_CANCEL, \
+                               MSG_RESULT, MSG_BUSY, MSG_ERROR
+
+SEND_INTERVAL = 0.1     # Seconds between sending the newly recorded audio while the hotkey is held down
+
+
+class RemoteUtterance(object):
+    '''A single recording being streamed to the server, and its result.'''
+
+    def __init__(self, client, utterance_id, get_audio):
+        self._client = client
+        self.id = utterance_id
+        self._get_audio = get_audio
+        self._sent = 0              # Number of samples already sent
+        self._send_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._done = threading.Event()
+        self.text = ""
+        self.error = None
+        self._thread = threading.Thread(target=self._stream, name="RemoteUtterance" + str(utterance_id), daemon=True)
+        self._thread.start()
+
+    def _stream(self):
+        # Send the audio as it's recorded, so that only the last moment needs to be sent after the hotkey is released.
+        # Only the new audio is read each time, rather than copying the whole recording again.
+        while not self._stop.wait(SEND_INTERVAL):
+            with self._send_lock:
+                self._send_new_audio(self._get_audio(since=self._sent))
+
+    def _send_new_audio(self, new_audio):
+        # 'new_audio' is the audio after the samples that were already sent. The caller must hold _send_lock.
+        if len(new_audio):
+            self._client._send(MSG_AUDIO, self.id, float32_to_int16(new_audio).tobytes())
+            self._sent += len(new_audio)
+
+    def finish(self, audio, speech=None):
+        # The hotkey was released: send the rest of the recording. If 'speech' is a (start, end) sample range,
+        # only that part is transcribed.
+        self._stop.set()
+        self._thread.join()
+        with self._send_lock:
+            self._send_new_audio(audio[self._sent:])
+        payload = json.dumps({"start": speech[0], "end": speech[1]}).encode("utf-8") if speech else b""
+        self._client._send(MSG_END, self.id, payload)
+
+    def cancel(self):
+        self._stop.set()
+        self._client._send(MSG_CANCEL, self.id)
+        self._client._forget(self.id)
+        self._resolve("", None)
+
+    def result(self, timeout=None):
+        # Wait for the transcript. Returns "" if the server was busy, failed, didn't answer within 'timeout' seconds,
+        # or the recording was cancelled.
+        if not self._done.wait(timeout):
+            self._client._send(MSG_CANCEL, self.id)
+            self._client._forget(self.id)
+            self._resolve("", "The recognition server didn't answer within " + '{0:.1f}'.format(timeout) + " seconds")
+        if self.error:
+            print("ERROR: Remote speech recognition failed:", self.error)
+        return self.text
+
+    def _resolve(self, text, error):
+        if not self._done.is_set():
+            self.text = text
+            self.error = error
+            self._done.set()
+
+
+class RecognitionClient(object):
+    '''A connection to the recognition daemon, shared by all the recordings of this push-to-talk client.'''
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(socket_path)
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._next_id = 0
+        self._utterances = {}
+        self.connected = True
+        threading.Thread(target=self._read_loop, name="RecognitionClient", daemon=True).start()
+
+    def begin(self, get_audio):
+        # Start streaming a new recording. get_audio(since) should return the audio recorded so far, from sample
+        # 'since' onwards.
+        with self._lock:
+            utterance_id = self._next_id
+            self._next_id += 1
+        self._send(MSG_START, utterance_id)
+        utterance = RemoteUtterance(self, utterance_id, get_audio)
+        with self._lock:
+            if self.connected:
+                self._utterances[utterance_id] = utterance
+            else:
+                utterance._resolve("", "Not connected to the recognition server")
+        return utterance
+
+    def _forget(self, utterance_id):
+        with self._lock:
+            self._utterances.pop(utterance_id, None)
+
+    def _send(self, msg_type, utterance_id, payload=b""):
+        with self._send_lock:
+            if not self.connected:
+                return
+            try:
+                send_message(self._sock, msg_type, utterance_id, payload)
+            except OSError as e:
+                print("ERROR: Lost the connection to the recognition server:", e)
+                self.connected = False
+
+    def _read_loop(self):
+        while True:
+            try:
+                message = recv_message(self._sock)
+            except OSError:
+                message = None
+            if message is None:
+                break
+            msg_type, utterance_id, payload = message
+            with self._lock:
+                utterance = self._utterances.pop(utterance_id, None)
+            if not utterance:
+                continue
+            if msg_type == MSG_RESULT:
+                utterance._resolve(payload.decode("utf-8"), None)
+            elif msg_type == MSG_BUSY:
+                utterance._resolve("", "The recognition server is too busy, so the recording was dropped")
+            elif msg_type == MSG_ERROR:
+                utterance._resolve("", payload.decode("utf-8"))
+
+        # The server went away, so don't leave any recordings waiting forever.
+        with self._lock:
+            self.connected = False
+            utterances = list(self._utterances.values())
+            self._utterances.clear()
+        for utterance in utterances:
+            utterance._resolve("", "Lost the connection to the recognition server")
@@ -0,0 +1,161 @@
+# coding: utf-8
+
+# A job queue for running speech recognition in the background, on a pool of worker threads.
+# The hotkey listener only needs to submit each recording, so it never blocks while Whisper is running.
+# Results are output strictly in the order that the recordings were captured, even if a later (shorter)
+# recording finishes recognition first.
+
+import queue
+import threading
+
+
+class RecognitionJob(object):
+    '''A single recording waiting for (or undergoing) speech recognition.'''
+
+    def __init__(self, seq, slot, duration, streaming_transcriber=None, trace=None, remote=None, profile=None):
+        self.seq = seq              # Capture order, starting from 0
+        self.slot = slot            # The RecordingSlot holding the audio, released once the job is done
+        self.duration = duration    # Recording length in seconds
+        self.streaming_transcriber = streaming_transcriber  # Set if the recording was partly transcribed while recording
+        self.trace = trace          # An optional UtteranceTrace, for latency tracing
+        self.remote = remote        # Set if the recording is being recognised by a recognition server
+        self.profile = profile      # The decoding settings of the hotkey that was used, or None for the defaults
+        self.result = ""            # The recognised text, once it's ready
+        self.typed_early = ""       # Text that was already typed before the result was output, such as a draft
+        self.cancelled = threading.Event()
+
+    @property
+    def audio(self):
+        # float32 16kHz NumPy array
+        return self.slot.audio
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def is_cancelled(self):
+        return self.cancelled.is_set()
+
+
+class RecognitionQueue(object):
+    '''Runs recognize(job) on a pool of worker threads, then calls output(job) on a separate output thread,
+    one job at a time and in capture order. recognize() should return the text, and can check job.is_cancelled()
+    to abort early.
+    If recognize_batch(jobs) is given, then whenever several jobs are waiting, a worker takes upto max_batch_size
+    of them at once and recognize_batch() should return a list with the text of each job.
+    If discard(job) is given, it's called on the output thread instead of output(job) for each cancelled job, in the
+    same order, such as to delete any text that was typed before the job was cancelled.
+    '''
+
+    def __init__(self, recognize, output, num_workers=1, recognize_batch=None, max_batch_size=1, discard=None):
+        self._recognize = recognize
+        self._output = output
+        self._discard = discard
+        self._recognize_batch = recognize_batch
+        self.max_batch_size = max_batch_size if recognize_batch else 1
+        self._jobs = queue.Queue()
+        self._cond = threading.Condition()
+        self._active = {}           # Jobs that were submitted but not yet output, by sequence number
+        self._finished = {}         # Jobs that finished recognition but are waiting for earlier jobs to be output
+        self._next_seq = 0
+        self._next_output_seq = 0
+        self._stopping = False
+
+        self._threads = []
+        for i in range(max(1, num_workers)):
+            self._threads.append(threading.Thread(target=self._worker, name="RecognitionWorker" + str(i), daemon=True))
+        self._threads.append(threading.Thread(target=self._output_loop, name="RecognitionOutput", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, slot, duration, streaming_transcriber=None, trace=None, remote=None, profile=None):
+        # Add a recording to the queue, and return its job. This returns immediately.
+        # The queue takes over the caller's reference to the recording slot.
+        with self._cond:
+            job = RecognitionJob(self._next_seq, slot, duration, streaming_transcriber, trace, remote, profile)
+            self._next_seq += 1
+            self._active[job.seq] = job
+        self._jobs.put(job)
+        return job
+
+    def cancel_latest(self):
+        # Cancel the most recent job that hasn't been fully output yet, whether it's still queued or running.
+        # Returns the cancelled job, or None if there was nothing to cancel.
+        with self._cond:
+            for seq in sorted(self._active, reverse=True):
+                job = self._active[seq]
+                if not job.is_cancelled():
+                    job.cancel()
+                    return job
+        return None
+
+    def pending(self):
+        # The number of jobs that are queued, running, or waiting to be output.
+        with self._cond:
+            return len(self._active)
+
+    def is_next_output(self, job):
+        # True if every earlier job has already been output, so this job's text can be output straight away.
+        with self._cond:
+            return job.seq == self._next_output_seq
+
+    def shutdown(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for _ in range(len(self._threads) - 1):
+            self._jobs.put(None)
+
+    def _take_waiting_jobs(self, max_jobs):
+        # Take upto max_jobs more jobs that are already waiting in the queue, without blocking.
+        jobs = []
+        while len(jobs) < max_jobs:
+            try:
+                job = self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                self._jobs.put(None)    # Leave the shutdown request for this or another worker
+                break
+            jobs.append(job)
+        return jobs
+
+    def _worker(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            jobs = [job] + self._take_waiting_jobs(self.max_batch_size - 1)
+            todo = [j for j in jobs if not j.is_cancelled()]
+            try:
+                if len(todo) > 1:
+                    for j, result in zip(todo, self._recognize_batch(todo)):
+                        j.result = result
+                elif todo:
+                    todo[0].result = self._recognize(todo[0])
+            except Exception as e:
+                print("ERROR: Speech recognition failed:", e)
+            with self._cond:
+                for j in jobs:
+                    self._finished[j.seq] = j
+                self._cond.notify_all()
+
+    def _output_loop(self):
+        while True:
+            with self._cond:
+                while self._next_output_seq not in self._finished and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    break
+                job = self._finished.pop(self._next_output_seq)
+            # Call the output function without holding the lock, so new jobs can still be submitted.
+            try:
+                if not job.is_cancelled():
+                    self._output(job)
+                elif self._discard:
+                    self._discard(job)
+            except Exception as e:
+                print("ERROR: Couldn't output the recognition result:", e)
+            job.slot.release()
+            with self._cond:
+                del self._active[job.seq]
+                self._next_output_seq += 1
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# A long-lived speech recognition daemon, so that several push-to-talk clients (such as several users or sessions
+# on the same workstation) share a single copy of the Whisper model, and each client starts instantly.
+# Clients connect over a Unix socket, stream the raw 16-bit 16kHz mono PCM audio while the hotkey is held down, and
+# get back the transcript once the hotkey is released. Set RECOGNITION_SERVER_SOCKET in ptt_whisper.py to use it.
+#
+# Each message is a header of (type, utterance id, payload length) followed by the payload:
+#   Client to server:  START, AUDIO (PCM bytes), END (optional JSON {"start": sample, "end": sample} to only
+#                      transcribe the speech), CANCEL
+#   Server to client:  RESULT (UTF-8 text), BUSY (the request was rejected because of backpressure), ERROR (UTF-8 text)
+# Each client has its own queue, and the clients take turns, with atmost 1 recording per client being recognised at a
+# time. So a client that queues many recordings can't delay the other clients, and its results stay in order.
+# Requests beyond MAX_PENDING_PER_CLIENT (or MAX_PENDING_TOTAL over all clients) are rejected with BUSY.
+#
+# Usage: ./recognition_server.py [--socket PATH]
+
+import os
+import sys
+import json
+import time
+import socket
+import struct
+import argparse
+import threading
+import collections
+import numpy as np
+
+from audio_io import WHISPER_RATE, int16_to_float32
+
+MSG_START = 1
+MSG_AUDIO = 2
+MSG_END = 3
+MSG_CANCEL = 4
+MSG_RESULT = 5
+MSG_BUSY = 6
+MSG_ERROR = 7
+
+HEADER = struct.Struct("!BII")      # Message type, utterance id, payload length
+SOCKET_MODE = 0o660                 # Allow the users in the socket's group to connect
+MAX_PENDING_PER_CLIENT = 4          # Recordings that each client can have waiting or being recognised
+MAX_PENDING_TOTAL = 32              # Recordings waiting or being recognised, over all the clients
+MAX_UTTERANCE_SECONDS = 300         # Longer recordings are rejected, to bound the memory used per client
+
+
+def default_socket_path():
+    return os.path.join(os.environ.get("XDG_RUNTIME_DIR") or "/tmp", "push-to-whisper.sock")
+
+
+def socket_in_use(socket_path):
+    # Whether a running server is listening on the socket, rather than it being left over from a server that crashed.
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def send_message(sock, msg_type, utterance_id, payload=b""):
+    sock.sendall(HEADER.pack(msg_type, utterance_id, len(payload)) + payload)
+
+
+def _recv_exactly(sock, length):
+    data = bytearray()
+    while len(data) < length:
+        chunk = sock.recv(length - len(data))
+        if not chunk:
+            return None
+        data.extend(chunk)
+    return bytes(data)
+
+
+def recv_message(sock):
+    # Returns (type, utterance id, payload), or None if the connection was closed.
+    header = _recv_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    msg_type, utterance_id, length = HEADER.unpack(header)
+    payload = _recv_exactly(sock, length) if length else b""
+    if payload is None:
+        return None
+    return msg_type, utterance_id, payload
+
+
+class RecognitionRequest(object):
+    '''A finished recording from a client, waiting for (or undergoing) recognition.'''
+
+    def __init__(self, client, utterance_id, audio):
+        self.client = client
+        self.utterance_id = utterance_id
+        self.audio = audio
+        self.cancelled = threading.Event()
+        self.time_queued = time.perf_counter()
+
+
+class FairScheduler(object):
+    '''Hands out the queued requests by taking turns between the clients, with atmost 1 request per client at a time.'''
+
+    def __init__(self, max_per_client=MAX_PENDING_PER_CLIENT, max_total=MAX_PENDING_TOTAL):
+        self.max_per_client = max_per_client
+        self.max_total = max_total
+        self._cond = threading.Condition()
+        self._queues = collections.OrderedDict()    # Queued requests of each client, in turn order
+        self._running = set()                       # Clients that have a request being recognised
+        self._total = 0                             # Queued & running requests
+
+    def submit(self, request):
+        # Returns False if the request was rejected because too many are already pending.
+        with self._cond:
+            queue = self._queues.setdefault(request.client, collections.deque())
+            pending = len(queue) + (1 if request.client in self._running else 0)
+            if pending >= self.max_per_client or self._total >= self.max_total:
+                if not queue:
+                    del self._queues[request.client]
+                return False
+            queue.append(request)
+            self._total += 1
+            self._cond.notify()
+            return True
+
+    def take(self):
+        # Blocks until a request is ready, then returns it. The client goes to the back of the turn order.
+        with self._cond:
+            while True:
+                for client, queue in self._queues.items():
+                    if client not in self._running:
+                        request = queue.popleft()
+                        del self._queues[client]
+                        if queue:
+                            self._queues[client] = queue
+                        self._running.add(client)
+                        return request
+                self._cond.wait()
+
+    def done(self, request):
+        with self._cond:
+            self._running.discard(request.client)
+            self._total -= 1
+            self._cond.notify_all()
+
+    def cancel(self, client, utterance_id=None):
+        # Remove a client's queued request (or all of them), and signal its running request to stop.
+        # Returns the requests that were removed from the queue.
+        with self._cond:
+            removed = []
+            queue = self._queues.get(client)
+            if queue:
+                removed = [r for r in queue if utterance_id is None or r.utterance_id == utterance_id]
+                for request in removed:
+                    queue.remove(request)
+                    request.cancelled.set()
+                if not queue:
+                    del self._queues[client]
+                self._total -= len(removed)
+                self._cond.notify_all()
+            return removed
+
+    def pending(self):
+        with self._cond:
+            return self._total
+
+
+class ClientConnection(object):
+    '''Reads the audio that a single client streams, and sends it the results.'''
+
+    def __init__(self, server, sock, client_id):
+        self.server = server
+        self.sock = sock
+        self.id = client_id
+        self._send_lock = threading.Lock()
+        self._utterances = {}       # The audio being streamed for each utterance id
+        self._running = {}          # Requests given to the scheduler, by utterance id
+        self.connected = True
+
+    def send(self, msg_type, utterance_id, payload=b""):
+        with self._send_lock:
+            if not self.connected:
+                return
+            try:
+                send_message(self.sock, msg_type, utterance_id, payload)
+            except OSError:
+                self.connected = False
+
+    def run(self):
+        max_bytes = MAX_UTTERANCE_SECONDS * WHISPER_RATE * 2
+        try:
+            while True:
+                message = recv_message(self.sock)
+                if message is None:
+                    break
+                msg_type, utterance_id, payload = message
+                if msg_type == MSG_START:
+                    self._utterances[utterance_id] = bytearray()
+                elif msg_type == MSG_AUDIO:
+                    buf = self._utterances.get(utterance_id)
+                    if buf is not None:
+                        if len(buf) + len(payload) > max_bytes:
+                            # Stop buffering a recording that is too long, and reject it once it ends.
+                            self._utterances[utterance_id] = None
+                        else:
+                            buf.extend(payload)
+                elif msg_type == MSG_END:
+                    self._finish_utterance(utterance_id, payload)
+                elif msg_type == MSG_CANCEL:
+                    self._utterances.pop(utterance_id, None)
+                    # A request that was still queued will never be finished(), so forget it here.
+                    for request in self.server.scheduler.cancel(self, utterance_id):
+                        self._running.pop(request.utterance_id, None)
+                    request = self._running.get(utterance_id)
+                    if request:
+                        request.cancelled.set()
+        except OSError:
+            pass
+        finally:
+            self.connected = False
+            self.server.scheduler.cancel(self)
+            for request in list(self._running.values()):
+                request.cancelled.set()
+            self.sock.close()
+            self.server.disconnected(self)
+
+    def _finish_utterance(self, utterance_id, payload):
+        if utterance_id not in self._utterances:
+            return
+        buf = self._utterances.pop(utterance_id)
+        if buf is None:
+            self.send(MSG_ERROR, utterance_id, b"The recording is too long")
+            return
+        audio = int16_to_float32(np.frombuffer(bytes(buf), dtype=np.int16))
+        if payload:
+            # Only transcribe the speech that the client's VAD found.
+            speech = json.loads(payload.decode("utf-8"))
+            audio = audio[speech.get("start", 0):speech.get("end", len(audio))]
+        request = RecognitionRequest(self, utterance_id, audio)
+        self._running[utterance_id] = request
+        if not self.server.scheduler.submit(request):
+            del self._running[utterance_id]
+            self.send(MSG_BUSY, utterance_id)
+
+    def finished(self, request, text):
+        self._running.pop(request.utterance_id, None)
+        if not request.cancelled.is_set():
+            self.send(MSG_RESULT, request.utterance_id, text.encode("utf-8"))
+
+
+class RecognitionServer(object):
+    '''Accepts clients on a Unix socket, and recognises their recordings on a pool of workers.
+    recognize(audio, cancel_event) must return the text of the float32 16kHz audio.
+    '''
+
+    def __init__(self, socket_path, recognize, num_workers=1):
+        self.socket_path = socket_path
+        self.recognize = recognize
+        self.scheduler = FairScheduler()
+        self._lock = threading.Lock()
+        self._clients = set()
+        self._next_client_id = 0
+        for i in range(max(1, num_workers)):
+            threading.Thread(target=self._worker, name="RecognitionWorker" + str(i), daemon=True).start()
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            if socket_in_use(self.socket_path):
+                raise RuntimeError("Another recognition server is already listening on '" + self.socket_path + "'")
+            os.remove(self.socket_path)     # Left over from a previous run that didn't exit cleanly
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        os.chmod(self.socket_path, SOCKET_MODE)
+        server.listen()
+        print("Listening for push-to-talk clients on '" + self.socket_path + "'")
+        try:
+            while True:
+                sock, _ = server.accept()
+                with self._lock:
+                    client = ClientConnection(self, sock, self._next_client_id)
+                    self._next_client_id += 1
+                    self._clients.add(client)
+                    print("Client", client.id, "connected.", len(self._clients), "client(s) now connected.")
+                threading.Thread(target=client.run, name="Client" + str(client.id), daemon=True).start()
+        finally:
+            server.close()
+            os.remove(self.socket_path)
+
+    def disconnected(self, client):
+        with self._lock:
+            self._clients.discard(client)
+            print("Client", client.id, "disconnected.", len(self._clients), "client(s) still connected.")
+
+    def _worker(self):
+        while True:
+            request = self.scheduler.take()
+            text = ""
+            try:
+                if not request.cancelled.is_set():
+                    wait = time.perf_counter() - request.time_queued
+                    print("Recognising", '{0:.1f}'.format(len(request.audio) / WHISPER_RATE), "seconds for client",
+                          request.client.id, "after waiting", '{0:.3f}'.format(wait), "seconds.",
+                          self.scheduler.pending() - 1, "other request(s) pending.")
+                    text = self.recognize(request.audio, request.cancelled)
+            except Exception as e:
+                print("ERROR: Speech recognition failed:", e)
+            # Send the result before the client's next request can start, so its results stay in order.
+            request.client.finished(request, text)
+            self.scheduler.done(request)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Speech recognition daemon shared by push-to-talk clients.")
+    parser.add_argument("--socket", default=default_socket_path(), help="Path of the Unix socket to listen on")
+    args = parser.parse_args(argv)
+    if os.path.exists(args.socket) and socket_in_use(args.socket):
+        print("ERROR: Another recognition server is already listening on '" + args.socket + "'")
+        return 1
+
+    # Use the same settings & decoding path as ptt_whisper.py, but load the model here instead of in each client.
+    import ptt_whisper
+    ptt_whisper.RECOGNITION_SERVER_SOCKET = None
+    ptt_whisper.loadWhisperModel()
+    ptt_whisper.recordStartupTime("model loaded")
+    ptt_whisper.warmUpModel()
+    ptt_whisper.model_ready.set()
+    ptt_whisper.recordStartupTime("model warmed up")
+
+    def recognize(audio, cancel_event):
+        return ptt_whisper.performSpeechRecOnFile(audio, cancel_event)
+
+    num_workers = ptt_whisper.NUM_FASTER_WHISPER_WORKERS if ptt_whisper.USE_FASTER_WHISPER else 1
+    RecognitionServer(args.socket, recognize, num_workers).serve_forever()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
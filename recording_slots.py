@@ -0,0 +1,135 @@
+# coding: utf-8
+
+# Keeps each recording in its own uniquely numbered, reference-counted slot in memory, until its speech recognition
+# has finished. This avoids several overlapping recordings fighting over the same "recording0.wav" file, and avoids
+# writing to disk. If the recordings waiting for recognition use more than 'max_bytes' of RAM, the newest waiting
+# ones are moved to tmpfs (/dev/shm) rather than the current folder, and reloaded when they're recognised. The oldest
+# ones stay in memory, since they'll be recognised next.
+# A slot is freed once the recognition queue and any background spill of it have both released their references.
+
+import os
+import tempfile
+import threading
+
+from audio_io import WHISPER_RATE, float32_to_int16, load_wav_file, save_wav_file
+
+
+def _spill_folder():
+    # Prefer tmpfs, so that spilled recordings still stay in RAM rather than going to disk.
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+class RecordingSlot(object):
+    '''A single recording, kept alive while anything holds a reference to it.'''
+
+    def __init__(self, manager, slot_id):
+        self.id = slot_id
+        self._manager = manager
+        self._refs = 1
+        self._lock = threading.Lock()   # Stops the audio being moved to tmpfs while it's being read
+        self._audio = None
+        self._spilled_fname = None      # A tmpfs WAV file holding the audio, once moved out of our memory
+        self._spilling = False          # Set once the slot is queued to be moved to tmpfs
+
+    @property
+    def audio(self):
+        # The float32 16kHz audio, reloaded from tmpfs if it was moved out of memory.
+        with self._lock:
+            audio = self._audio
+            if audio is None and self._spilled_fname:
+                audio = load_wav_file(self._spilled_fname)
+        return audio
+
+    def set_audio(self, audio):
+        self._audio = audio
+        self._manager._added(self)
+
+    def nbytes(self):
+        return self._audio.nbytes if self._audio is not None else 0
+
+    def acquire(self):
+        # Add a reference, which must be given back with release(). The caller must hold the manager's lock, so that
+        # the slot can't be freed before then.
+        self._refs += 1
+        return self
+
+    def release(self):
+        with self._manager._lock:
+            self._refs -= 1
+            if self._refs > 0:
+                return
+            self._manager._slots.pop(self.id, None)
+        self._free()
+
+    def _move_out_of_memory(self):
+        with self._lock:
+            if self._audio is None or self._spilled_fname:
+                return
+            fname = os.path.join(_spill_folder(), "push-to-whisper-" + str(os.getpid()) + "-" + str(self.id) + ".wav")
+            save_wav_file(fname, float32_to_int16(self._audio), WHISPER_RATE)
+            self._spilled_fname = fname
+            self._audio = None
+
+    def _free(self):
+        with self._lock:
+            self._audio = None
+            if self._spilled_fname:
+                try:
+                    os.remove(self._spilled_fname)
+                except OSError:
+                    pass
+                self._spilled_fname = None
+
+
+class RecordingSlotManager(object):
+    '''Hands out uniquely numbered recording slots, and keeps the RAM used by them bounded.'''
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._slots = {}            # Live slots, by id. Python dicts keep the insertion order, so the oldest is first.
+
+    def allocate(self):
+        # Returns a new slot with a single reference, owned by the caller.
+        with self._lock:
+            slot = RecordingSlot(self, self._next_id)
+            self._next_id += 1
+            self._slots[slot.id] = slot
+        return slot
+
+    def live_slots(self):
+        with self._lock:
+            return len(self._slots)
+
+    def memory_used(self):
+        with self._lock:
+            return sum(slot.nbytes() for slot in self._slots.values())
+
+    def _added(self, slot):
+        # Move the newest waiting recordings to tmpfs if we are using too much memory, but never the one that was just
+        # recorded, and keep the oldest ones that will be recognised next in memory.
+        # This is called from the hotkey thread, so the files are written on a background thread, which holds a
+        # reference to each slot until it's done.
+        spill = []
+        with self._lock:
+            used = sum(s.nbytes() for s in self._slots.values() if not s._spilling)
+            for other in reversed(list(self._slots.values())):
+                if used <= self.max_bytes:
+                    break
+                if other is slot or other._spilling or not other.nbytes():
+                    continue
+                used -= other.nbytes()
+                other._spilling = True
+                spill.append(other.acquire())
+        if spill:
+            threading.Thread(target=self._spill, args=(spill,), name="SpillRecordings", daemon=True).start()
+
+    def _spill(self, slots):
+        for slot in slots:
+            try:
+                slot._move_out_of_memory()
+            finally:
+                slot.release()
@@ -0,0 +1,138 @@
+# coding: utf-8
+
+# Stand-ins for the hardware, so the whole dictation pipeline can run on a headless server without a mic, an X
+# keyboard or anything to type into, such as for load testing & performance regression tests:
+#   - ReplayAudioSource plays back WAV clips instead of recording the mic, with the same interface as RecordingFile.
+#   - ScriptedHotkeySource presses & releases the dictation hotkey (and the cancel hotkey) following a timeline,
+#     optionally faster than real-time.
+#   - CapturingTyper keeps the text that would have been typed, with the same interface as PynputTyper.
+# A timeline is a list of events such as {"at": 1.5, "event": "down", "clip": "hello.wav"}, where "event" is "down",
+# "up" or "cancel", and "at" is the number of seconds from the start. It can be loaded from a JSON lines file.
+
+import os
+import json
+import time
+import threading
+import numpy as np
+
+from audio_io import WHISPER_RATE, CHUNK, load_wav_file
+
+
+def load_timeline(fname):
+    # Load a timeline from a JSON lines file, with each clip's audio. Clip filenames are relative to the timeline file.
+    folder = os.path.dirname(os.path.abspath(fname))
+    events = []
+    with open(fname, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if event.get("clip"):
+                event["clip"] = os.path.join(folder, event["clip"])
+                event["audio"] = load_wav_file(event["clip"])
+            events.append(event)
+    return sorted(events, key=lambda event: event["at"])
+
+
+def timeline_from_clips(clips, gap=1.0):
+    # Make a timeline that dictates each (name, audio) clip in turn, holding the hotkey for the length of the clip and
+    # waiting 'gap' seconds between clips. A small or zero gap queues the recordings faster than they can be recognised.
+    events = []
+    at = 0.0
+    for name, audio in clips:
+        events.append({"at": at, "event": "down", "clip": name, "audio": audio})
+        at += len(audio) / float(WHISPER_RATE)
+        events.append({"at": at, "event": "up"})
+        at += gap
+    return events
+
+
+class ReplayAudioSource(object):
+    '''Plays back the clip given to set_clip() as if it was recorded from the mic, with the same interface as RecordingFile.'''
+
+    def __init__(self, speed=1.0):
+        self.speed = speed              # How much faster than real-time the clips are "recorded"
+        self.keep_stream_open = False
+        self.time_start = None
+        self.time_first_chunk = None
+        self.duration = 0.0
+        self._clip = np.zeros(0, dtype=np.float32)
+
+    def set_clip(self, audio):
+        self._clip = np.asarray(audio, dtype=np.float32)
+
+    def start_recording(self, fname=None):
+        self.time_start = time.perf_counter()
+        # Like a real mic, the first chunk of audio would arrive after a chunk's worth of samples.
+        self.time_first_chunk = self.time_start + CHUNK / float(WHISPER_RATE) / self.speed
+        return self
+
+    def get_audio(self, since=0):
+        # The part of the clip that would have been recorded so far, from sample 'since' onwards.
+        elapsed = (time.perf_counter() - self.time_start) * self.speed
+        return self._clip[since:int(elapsed * WHISPER_RATE)].copy()
+
+    def stop_recording(self):
+        # The whole clip, even if the hotkey was released a little early.
+        self.duration = len(self._clip) / float(WHISPER_RATE)
+        return self._clip.copy()
+
+    def close(self):
+        pass
+
+
+class ScriptedHotkeySource(object):
+    '''Calls the hotkey handlers following a timeline, instead of listening to the keyboard.'''
+
+    def __init__(self, timeline, audio_source, speed=1.0):
+        self.timeline = sorted(timeline, key=lambda event: event["at"])
+        self.audio_source = audio_source
+        self.speed = speed
+
+    def run(self, key_pressed, key_released, cancel_pressed):
+        # Blocks until the whole timeline has been played. Each event happens at its time divided by the speed.
+        start = time.perf_counter()
+        for event in self.timeline:
+            delay = start + event["at"] / self.speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if event["event"] == "down":
+                self.audio_source.set_clip(event["audio"])
+                key_pressed()
+            elif event["event"] == "up":
+                key_released()
+            elif event["event"] == "cancel":
+                cancel_pressed()
+        return time.perf_counter() - start
+
+
+class CapturingTyper(object):
+    '''Keeps the text that would have been typed, and when each part was typed, instead of pressing any keys.'''
+
+    def __init__(self, char_delay=0.0):
+        self.char_delay = char_delay    # Seconds to wait per character, to simulate a slow typing backend
+        self._lock = threading.Lock()
+        self._text = []
+        self.events = []                # (perf_counter time, typed text or None for a backspace)
+
+    @property
+    def text(self):
+        with self._lock:
+            return "".join(self._text)
+
+    def type(self, text, cancel_event=None):
+        if cancel_event and cancel_event.is_set():
+            return
+        if self.char_delay:
+            time.sleep(self.char_delay * len(text))
+        with self._lock:
+            self._text.append(text)
+            self.events.append((time.perf_counter(), text))
+
+    def backspace(self, count, cancel_event=None):
+        if cancel_event and cancel_event.is_set():
+            return
+        with self._lock:
+            text = "".join(self._text)
+            self._text = [text[:max(0, len(text) - count)]]
+            self.events.append((time.perf_counter(), None))
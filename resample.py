@@ -0,0 +1,78 @@
+# coding: utf-8
+
+# Fast vectorised polyphase resampler using NumPy, that can process audio in chunks as it arrives from the mic.
+# It's used when the mic doesn't support recording at Whisper's 16kHz sampling rate, so that the audio is already at
+# the model's rate when the hotkey is released, without needing ffmpeg to resample it.
+
+from math import gcd
+import numpy as np
+
+
+TAPS_PER_PHASE = 24         # Filter length per polyphase branch. More taps give a sharper anti-aliasing filter but more CPU.
+KAISER_BETA = 8.0           # Kaiser window shape, trades off stopband attenuation vs transition width.
+
+
+def design_lowpass_filter(up, down, taps_per_phase=TAPS_PER_PHASE, beta=KAISER_BETA):
+    # Windowed-sinc lowpass filter at the upsampled rate, with the cutoff at the lower of the two Nyquist rates.
+    num_taps = taps_per_phase * up
+    cutoff = 0.5 / max(up, down)    # In cycles per sample, at the upsampled rate
+    n = np.arange(num_taps) - (num_taps - 1) / 2.0
+    h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(num_taps, beta)
+    # Scale by 'up' to keep unity gain after inserting zeros between the samples.
+    return h * (up / np.sum(h))
+
+
+class PolyphaseResampler(object):
+    '''Streaming rational resampler (eg: 44.1kHz -> 16kHz). Call process() on each chunk as it arrives,
+    then flush() once at the end to get the remaining filter tail.
+    '''
+
+    def __init__(self, from_rate, to_rate, taps_per_phase=TAPS_PER_PHASE):
+        g = gcd(int(from_rate), int(to_rate))
+        self.up = int(to_rate) // g
+        self.down = int(from_rate) // g
+        self.taps_per_phase = taps_per_phase
+        h = design_lowpass_filter(self.up, self.down, taps_per_phase)
+        # Split the filter into its polyphase branches. Row p holds taps h[p], h[p + up], h[p + 2*up], ...
+        self._phases = h.reshape(taps_per_phase, self.up).T.astype(np.float32).copy()
+        self._tap_offsets = np.arange(taps_per_phase)
+        self.reset()
+
+    def reset(self):
+        # Forget the previous audio, ready for a new recording.
+        self._history = np.zeros(self.taps_per_phase - 1, dtype=np.float32)
+        self._consumed = 0          # Number of input samples processed so far
+        self._next_output = 0       # Index of the next output sample to generate
+
+    def process(self, samples):
+        # Resample the next chunk of float32 audio, returning the output samples that are now available.
+        samples = np.asarray(samples, dtype=np.float32)
+        buf = np.concatenate((self._history, samples))
+        base = self._consumed - len(self._history)      # Absolute input index of buf[0]
+        end = self._consumed + len(samples)             # Absolute input index just after this chunk
+
+        # Output sample m is centred at input position m*down/up, so it's available once that input sample arrived.
+        last_output = (end * self.up - 1) // self.down + 1 if end > 0 else 0
+        m = np.arange(self._next_output, last_output, dtype=np.int64)
+        t = m * self.down
+        newest = t // self.up - base        # Index in buf of the newest input sample used by each output
+        phase = t % self.up
+        windows = buf[newest[:, None] - self._tap_offsets[None, :]]
+        out = np.einsum('ij,ij->i', windows, self._phases[phase])
+
+        self._next_output = last_output
+        self._consumed = end
+        self._history = buf[len(buf) - (self.taps_per_phase - 1):]
+        return out.astype(np.float32)
+
+    def flush(self):
+        # Push zeros through the filter to get the last few output samples.
+        return self.process(np.zeros(self.taps_per_phase // 2, dtype=np.float32))
+
+
+def resample(audio, from_rate, to_rate):
+    # Resample a whole recording at once.
+    if from_rate == to_rate:
+        return np.asarray(audio, dtype=np.float32)
+    resampler = PolyphaseResampler(from_rate, to_rate)
+    return np.concatenate((resampler.process(audio), resampler.flush()))
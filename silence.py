@@ -0,0 +1,84 @@
+# coding: utf-8
+
+# Fast energy-based silence detection on the recorded audio, using NumPy.
+# Used to trim the silence before & after the speech, and to split long recordings into windows of upto 30 seconds
+# at quiet moments, so that OpenAI Whisper only processes as much audio as was actually spoken, and nothing is
+# silently cut off after 30 seconds.
+
+import numpy as np
+
+from audio_io import WHISPER_RATE
+
+FRAME_SECONDS = 0.02        # Measure the energy in 20ms frames
+SPEECH_MARGIN_DB = 12.0     # Frames this much louder than the background noise are considered speech
+MIN_SPEECH_DB = -55.0       # Frames quieter than this are always considered silence, even in a silent room
+LOUD_SPEECH_DB = -30.0      # If the loudest frame is louder than this, the recording contains speech even if it has
+SPEECH_RANGE_DB = 20.0      # no quiet stretch to measure the background noise from, so frames within SPEECH_RANGE_DB
+                            # of the loudest frame are speech.
+PADDING_SECONDS = 0.2       # Keep a little audio before & after the speech, so we don't clip soft word endings
+SPLIT_SEARCH_SECONDS = 5.0  # When splitting a long recording, look for the quietest frame within this many seconds of the limit
+
+
+def frame_energies(audio, rate=WHISPER_RATE):
+    # Returns the energy (in dB relative to full scale) of each frame of the audio.
+    frame_len = int(rate * FRAME_SECONDS)
+    n_frames = len(audio) // frame_len
+    if n_frames == 0:
+        return np.zeros(0, dtype=np.float32), frame_len
+    frames = np.asarray(audio[:n_frames * frame_len], dtype=np.float32).reshape(n_frames, frame_len)
+    power = np.mean(frames * frames, axis=1)
+    return 10.0 * np.log10(power + 1e-10), frame_len
+
+
+def speech_threshold(energies):
+    # Estimate the background noise level from the quietest frames, and set the speech threshold above it.
+    # Continuous speech without any pauses has no quiet frames, so then the threshold is set below the loudest frame.
+    noise_floor = np.percentile(energies, 10)
+    threshold = noise_floor + SPEECH_MARGIN_DB
+    loudest = np.max(energies)
+    if loudest > LOUD_SPEECH_DB:
+        threshold = min(threshold, loudest - SPEECH_RANGE_DB)
+    return max(threshold, MIN_SPEECH_DB)
+
+
+def find_speech(audio, rate=WHISPER_RATE):
+    # Returns the (start, end) sample range that contains speech, or None if the audio seems to be silent.
+    energies, frame_len = frame_energies(audio, rate)
+    if len(energies) == 0:
+        return None
+    loud = np.flatnonzero(energies > speech_threshold(energies))
+    if len(loud) == 0:
+        return None
+    padding = int(rate * PADDING_SECONDS)
+    start = max(0, loud[0] * frame_len - padding)
+    end = min(len(audio), (loud[-1] + 1) * frame_len + padding)
+    return int(start), int(end)
+
+
+def trim_silence(audio, rate=WHISPER_RATE):
+    # Remove the leading & trailing silence. Returns an empty array if there is no speech at all.
+    speech = find_speech(audio, rate)
+    if speech is None:
+        return audio[:0]
+    return audio[speech[0]:speech[1]]
+
+
+def split_on_silence(audio, rate=WHISPER_RATE, max_seconds=30.0):
+    # Split the audio into windows of atmost max_seconds, cutting at the quietest moment near the end of each window.
+    max_len = int(rate * max_seconds)
+    if len(audio) <= max_len:
+        return [audio] if len(audio) > 0 else []
+    energies, frame_len = frame_energies(audio, rate)
+    search_frames = int(SPLIT_SEARCH_SECONDS / FRAME_SECONDS)
+    windows = []
+    start = 0
+    while len(audio) - start > max_len:
+        # Look for the quietest frame in the last few seconds before the limit.
+        last_frame = (start + max_len) // frame_len
+        first_frame = max(start // frame_len + 1, last_frame - search_frames)
+        quietest = first_frame + int(np.argmin(energies[first_frame:last_frame]))
+        cut = quietest * frame_len + frame_len // 2
+        windows.append(audio[start:cut])
+        start = cut
+    windows.append(audio[start:])
+    return windows
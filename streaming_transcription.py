@@ -0,0 +1,118 @@
+# coding: utf-8
+
+# Incremental speech recognition while the hotkey is still being held down.
+# Every few moments it re-transcribes the audio recorded since the last committed word. Words that were given
+# identically by 2 consecutive passes are considered stable ("committed") and are typed out straight away.
+# Once the hotkey is released, only the audio after the last committed word needs to be transcribed,
+# so a long dictation doesn't have to wait for the whole recording to be decoded after the key is released.
+
+import time
+import threading
+
+from audio_io import WHISPER_RATE
+
+MIN_NEW_AUDIO = 0.5         # Seconds of new audio needed before it's worth running another partial pass
+PROMPT_CHARS = 200          # How much of the committed text to give Whisper as context for the next pass
+
+
+def normaliseWord(word):
+    # Compare words without caring about case, spacing or punctuation, since those often change between passes.
+    return "".join(c for c in word.lower() if c.isalnum())
+
+
+class StreamingTranscriber(object):
+    '''Runs partial transcriptions on a background thread while recording.
+    transcribe_words(audio, prompt) must return a list of words with .word, .start & .end attributes
+    (such as faster-whisper's word timestamps), where the times are relative to the start of 'audio'.
+    get_audio() must return all the audio recorded so far, as a float32 16kHz NumPy array.
+    output(typed_text, committed_text) is called whenever more text is committed, with all the committed text so far
+    and the text that output() returned last time (initially ""). It should return the text that is now typed, which
+    can differ from the committed text, such as after post-processing.
+    '''
+
+    def __init__(self, transcribe_words, get_audio, output, interval=1.0, initial_prompt=None):
+        self._transcribe_words = transcribe_words
+        self._get_audio = get_audio
+        self._output = output
+        self.interval = interval
+        self.initial_prompt = initial_prompt
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        self.committed_text = ""        # Text that was already sent to output()
+        self.typed_text = ""            # Text that output() typed for the committed text
+        self.committed_time = 0.0       # Seconds of audio covered by the committed text
+        self._previous_words = []       # Uncommitted words from the previous pass
+        self._seconds_per_audio_second = None   # Measured inference speed, to estimate the latency we saved
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="StreamingTranscriber", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        # Stop running partial passes, such as when the hotkey is released. Waits for any text being output.
+        with self._lock:
+            self._stopped.set()
+
+    def finish(self, audio):
+        # Called after the hotkey was released, with the full recording. Stops the partial passes and
+        # transcribes only the unstable tail. Returns the text that was already output, and the remaining text.
+        start_finish = time.perf_counter()
+        with self._lock:
+            self._stopped.set()
+            committed_text = self.committed_text
+            committed_time = self.committed_time
+            speed = self._seconds_per_audio_second
+
+        tail_words = self._transcribe_words(audio[int(committed_time * WHISPER_RATE):], self._prompt(committed_text))
+        tail_text = "".join(w.word for w in tail_words)
+        elapsed = time.perf_counter() - start_finish
+
+        # Report how much waiting we saved, compared to transcribing the whole recording after the key release.
+        duration = len(audio) / WHISPER_RATE
+        if committed_text and speed:
+            estimated_full = speed * duration
+            print("[Streaming: typed", len(committed_text), "chars early. Post-release decode took",
+                  '{0:.3f}'.format(elapsed), "seconds instead of about", '{0:.3f}'.format(estimated_full),
+                  "seconds, saving about", '{0:.3f}'.format(max(0.0, estimated_full - elapsed)), "seconds]")
+        return committed_text, tail_text
+
+    def _prompt(self, committed_text):
+        if committed_text:
+            return committed_text[-PROMPT_CHARS:]
+        return self.initial_prompt
+
+    def _loop(self):
+        while not self._stopped.wait(self.interval):
+            audio = self._get_audio()
+            with self._lock:
+                committed_time = self.committed_time
+                committed_text = self.committed_text
+            new_audio = audio[int(committed_time * WHISPER_RATE):]
+            if len(new_audio) / WHISPER_RATE < MIN_NEW_AUDIO:
+                continue
+
+            start_pass = time.perf_counter()
+            words = self._transcribe_words(new_audio, self._prompt(committed_text))
+            elapsed = time.perf_counter() - start_pass
+
+            with self._lock:
+                if self._stopped.is_set():
+                    break   # The key was released during this pass, so finish() handles the rest.
+                self._seconds_per_audio_second = elapsed / (len(new_audio) / WHISPER_RATE)
+                # Commit the words that agree with the previous pass, except the last word which might still change.
+                n = 0
+                while (n < len(words) - 1 and n < len(self._previous_words)
+                        and normaliseWord(words[n].word) == normaliseWord(self._previous_words[n].word)):
+                    n += 1
+                stable = words[:n]
+                self._previous_words = words[n:]
+                if not stable:
+                    continue
+                text = "".join(w.word for w in stable)
+                self.committed_text += text
+                self.committed_time = committed_time + stable[-1].end
+                # Output while holding the lock, so that finish() can't output the tail before this text.
+                self.typed_text = self._output(self.typed_text, self.committed_text)
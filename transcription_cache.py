@@ -0,0 +1,91 @@
+# coding: utf-8
+
+# Optional on-disk cache of speech recognition results, so that transcribing the exact same audio with the exact same
+# model & decoding settings (such as when replaying saved recordings or running tests) doesn't need to run Whisper again.
+# Each result is stored as a small JSON file named by a hash of the audio samples and the decoding settings.
+# The least recently used results are deleted once there are more than 'max_entries' of them.
+
+import os
+import json
+import hashlib
+import threading
+
+import numpy as np
+
+
+class TranscriptionCache(object):
+    '''An LRU cache of transcriptions on disk, keyed by the audio content plus the decoding parameters.'''
+
+    def __init__(self, directory, max_entries=1000):
+        self.directory = os.path.expanduser(directory)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(audio, params):
+        # 'audio' is a NumPy array of samples, or the filename of an audio file. 'params' is a dict of decoding settings.
+        h = hashlib.sha256()
+        if isinstance(audio, str):
+            with open(audio, 'rb') as f:
+                h.update(f.read())
+        else:
+            h.update(np.ascontiguousarray(audio, dtype=np.float32).tobytes())
+        h.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        # Returns the cached text, or None if it isn't in the cache.
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding="utf-8") as f:
+                text = json.load(f)["text"]
+            os.utime(path)     # Mark it as recently used
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return text
+
+    def put(self, key, text):
+        # Write to a temporary file then rename it, so other threads never see a partial file.
+        path = self._path(key)
+        tmp_path = path + "." + str(threading.get_ident()) + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding="utf-8") as f:
+                json.dump({"text": text}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print("Warning: Couldn't save to the transcription cache:", e)
+            return
+        self._evict()
+
+    def _evict(self):
+        # Delete the least recently used entries, to stay within max_entries.
+        with self._lock:
+            try:
+                entries = [e for e in os.scandir(self.directory) if e.name.endswith(".json")]
+            except OSError:
+                return
+            if len(entries) <= self.max_entries:
+                return
+            entries.sort(key=lambda e: e.stat().st_mtime)
+            for entry in entries[:len(entries) - self.max_entries]:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            hit_rate = 100.0 * self.hits / total if total else 0.0
+            return "Transcription cache: " + str(self.hits) + " hits, " + str(self.misses) + " misses (" + \
+                   '{0:.1f}'.format(hit_rate) + "% hit rate)"
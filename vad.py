@@ -0,0 +1,82 @@
+# coding: utf-8
+
+# A cheap voice activity detector (VAD) using the energy and zero-crossing rate of each 20ms frame, so that
+# accidental hotkey taps and silent recordings don't need to run Whisper at all (which is also where most of
+# Whisper's hallucinations come from), and only the part of the recording containing speech is passed to Whisper.
+
+import threading
+import numpy as np
+
+from silence import frame_energies, speech_threshold, WHISPER_RATE, PADDING_SECONDS, SPEECH_MARGIN_DB
+
+MIN_SPEECH_SECONDS = 0.2    # Recordings with less speech than this are treated as empty, such as a click or a cough
+MAX_NOISE_ZCR = 0.4         # Quiet frames with more zero-crossings than this are hiss or fan noise rather than voice
+LOUD_MARGIN_DB = 10.0       # Frames this far above the speech threshold are speech regardless of the zero-crossing rate
+
+
+def zero_crossing_rates(audio, frame_len):
+    # The fraction of samples in each frame where the signal changes sign.
+    n_frames = len(audio) // frame_len
+    frames = np.asarray(audio[:n_frames * frame_len]).reshape(n_frames, frame_len)
+    signs = np.signbit(frames)
+    return np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / float(frame_len - 1)
+
+
+def detect_speech(audio, rate=WHISPER_RATE):
+    # Returns the (start, end) sample range containing speech, or None if there isn't enough speech.
+    energies, frame_len = frame_energies(audio, rate)
+    if len(energies) == 0:
+        return None
+    threshold = speech_threshold(energies)
+    # Without a quiet stretch, the threshold can be far below the noise level, so noisy frames need to be loud
+    # compared to the background noise (not just the threshold) to skip the zero-crossing check.
+    loud_threshold = max(threshold, np.percentile(energies, 10) + SPEECH_MARGIN_DB) + LOUD_MARGIN_DB
+    zcr = zero_crossing_rates(audio, frame_len)
+    speech = (energies > threshold) & ((zcr < MAX_NOISE_ZCR) | (energies > loud_threshold))
+    frames = np.flatnonzero(speech)
+    if len(frames) * frame_len < MIN_SPEECH_SECONDS * rate:
+        return None
+    padding = int(rate * PADDING_SECONDS)
+    start = max(0, frames[0] * frame_len - padding)
+    end = min(len(audio), (frames[-1] + 1) * frame_len + padding)
+    return int(start), int(end)
+
+
+class VadStats(object):
+    '''Counts how many recordings were skipped by the VAD, and estimates how much Whisper compute that saved.'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.skipped = 0
+        self.skipped_audio_seconds = 0.0
+        self.trimmed_audio_seconds = 0.0    # Silence removed from recordings that did contain speech
+        self._inference_seconds = 0.0
+        self._inference_count = 0
+
+    def record_check(self, audio_seconds, speech_seconds):
+        with self._lock:
+            self.checked += 1
+            if speech_seconds is None:
+                self.skipped += 1
+                self.skipped_audio_seconds += audio_seconds
+            else:
+                self.trimmed_audio_seconds += audio_seconds - speech_seconds
+
+    def record_inference(self, inference_seconds):
+        # Keep track of how long each Whisper invocation takes, to estimate the compute we saved.
+        # Whisper's encoder always processes a 30 second window, so even a silent tap costs a whole invocation.
+        with self._lock:
+            self._inference_count += 1
+            self._inference_seconds += inference_seconds
+
+    def summary(self):
+        with self._lock:
+            skip_rate = 100.0 * self.skipped / self.checked if self.checked else 0.0
+            line = "VAD: skipped " + str(self.skipped) + " of " + str(self.checked) + " recordings (" + \
+                   '{0:.1f}'.format(skip_rate) + "%), and trimmed " + '{0:.1f}'.format(self.trimmed_audio_seconds) + \
+                   " seconds of silence"
+            if self._inference_count > 0:
+                saved = self.skipped * self._inference_seconds / self._inference_count
+                line += ", saving about " + '{0:.1f}'.format(saved) + " seconds of Whisper compute"
+            return line